@@ -43,6 +43,10 @@
 #define EEPROM_D0 5
 #define EEPROM_D7 12
 #define WRITE_EN 13
+#define PAGE_SIZE 64
+#define WRITE_CYCLE 10                  // ms, longest write cycle of the EEPROM
+#define BASE_SPEED 57600                // baud the Arduino starts at and falls back to
+#define SPEED_TIMEOUT 2000              // ms to get a command at a new speed
 
 
 /* ------------------------------------------------------------------------------------------ *
@@ -53,6 +57,7 @@ const char FIL = 1;
 const char CHK = 2;
 const char PRC = 3;
 const char ERR = 4;
+const char BIN = 5;
 char state = 0;
 
 /* ------------------------------------------------------------------------------------------ *
@@ -79,6 +84,12 @@ const char CLR = 1;
 const char REA = 2;
 const char WRI = 3;
 const char QUI = 4;
+const char WBI = 5;
+const char RBI = 6;
+const char FPA = 7;
+const char SPD = 8;
+const char ECH = 9;
+const char SKP = 10;
 char cc = 0;
 
 /* ------------------------------------------------------------------------------------------ *
@@ -87,6 +98,22 @@ char cc = 0;
 char strAdr[10], strOp1[5], strOp2[5], strOp3[5], strOp4[5], strOp5[5], strOp6[5], strOp7[5], strOp8[5], strLen[10];
 int adr, op1, op2, op3, op4, op5, op6, op7, op8, Len = 0;
 
+/* ------------------------------------------------------------------------------------------ *
+ * Frame of the binary Write command: WB, address high and low byte, length,
+ * up to PAGE_SIZE data bytes and a CRC-16/CCITT over address, length and data
+ * -------------------------------------------------------------------------------------------*/
+byte blk[PAGE_SIZE + 5];
+int blkPtr = 0;
+unsigned long blkTime = 0;
+
+/* ------------------------------------------------------------------------------------------ *
+ * Serial speed set by the SP command. SK at the new speed keeps it, without SK
+ * in SPEED_TIMEOUT ms the Arduino falls back to BASE_SPEED.
+ * -------------------------------------------------------------------------------------------*/
+long speed = BASE_SPEED;
+bool speedPending = false;
+unsigned long speedTime = 0;
+
 
 /* ------------------------------------------------------------------------------------------ *
  * Max number of times to try and write values untill readback is equal
@@ -94,16 +121,36 @@ int adr, op1, op2, op3, op4, op5, op6, op7, op8, Len = 0;
 int maxTries = 5;
 
 
+/* ------------------------------------------------------------------------------------------ *
+ * Shift a byte out to the shift registers, most significant bit first.
+ * Writes the ATmega328 port directly: SHIFT_DATA and SHIFT_CLK are PD2 and PD3.
+ * shiftOut() with digitalWrite() takes some 100 us per byte, too slow to load
+ * an EEPROM page, which requires the next byte within 150 us.
+ * -------------------------------------------------------------------------------------------*/
+void fastShiftOut(byte value) {
+  for (int bit = 7; bit >= 0; bit -= 1) {
+    if (value & (1 << bit)) {
+      PORTD |= (1 << 2);
+    } else {
+      PORTD &= ~(1 << 2);
+    }
+    PORTD |= (1 << 3);
+    PORTD &= ~(1 << 3);
+  }
+}
+
+
 /* ------------------------------------------------------------------------------------------ *
  * Output the address bits and outputEnable signal using shift registers.
+ * SHIFT_LATCH is PD4.
  * -------------------------------------------------------------------------------------------*/
 void setAddress(int address, bool outputEnable) {
-  shiftOut(SHIFT_DATA, SHIFT_CLK, MSBFIRST, (address >> 8) | (outputEnable ? 0x00 : 0x80));
-  shiftOut(SHIFT_DATA, SHIFT_CLK, MSBFIRST, address);
+  fastShiftOut((address >> 8) | (outputEnable ? 0x00 : 0x80));
+  fastShiftOut(address);
 
-  digitalWrite(SHIFT_LATCH, LOW);
-  digitalWrite(SHIFT_LATCH, HIGH);
-  digitalWrite(SHIFT_LATCH, LOW);
+  PORTD &= ~(1 << 4);
+  PORTD |= (1 << 4);
+  PORTD &= ~(1 << 4);
 }
 
 
@@ -124,10 +171,26 @@ byte readEEPROM(int address) {
 }
 
 
+/* ------------------------------------------------------------------------------------------ *
+ * Wait for the write cycle of the EEPROM to end, using DATA polling: while it
+ * writes, the EEPROM returns the complement of bit 7 of the last byte written.
+ * Gives up after the longest write cycle, the readback will show the failure.
+ * -------------------------------------------------------------------------------------------*/
+void waitWriteComplete(int address, byte data) {
+  unsigned long start = millis();
+  while (readEEPROM(address) != data) {
+    if (millis() - start > WRITE_CYCLE) {
+      break;
+    }
+  }
+}
+
+
 /* ------------------------------------------------------------------------------------------ *
  * Write a byte to the EEPROM at the specified address.
  * -------------------------------------------------------------------------------------------*/
 void writeEEPROM(int address, byte data) {
+  byte value = data;
   setAddress(address, /*outputEnable*/ false);
   for (int pin = EEPROM_D0; pin <= EEPROM_D7; pin += 1) {
     pinMode(pin, OUTPUT);
@@ -141,7 +204,31 @@ void writeEEPROM(int address, byte data) {
   digitalWrite(WRITE_EN, LOW);
   delayMicroseconds(1);
   digitalWrite(WRITE_EN, HIGH);
-  delay(10);
+  waitWriteComplete(address, value);
+}
+
+
+/* ------------------------------------------------------------------------------------------ *
+ * Write up to PAGE_SIZE bytes within one page of the EEPROM in a single write
+ * cycle. The bytes are loaded through the ports directly to stay within the
+ * byte load cycle time: EEPROM_D0 - D2 are PD5 - PD7, D3 - D7 are PB0 - PB4 and
+ * WRITE_EN is PB5.
+ * -------------------------------------------------------------------------------------------*/
+void writePage(int address, byte *data, int len) {
+  setAddress(address, /*outputEnable*/ false);
+  for (int pin = EEPROM_D0; pin <= EEPROM_D7; pin += 1) {
+    pinMode(pin, OUTPUT);
+  }
+
+  for (int i = 0; i < len; i += 1) {
+    setAddress(address + i, /*outputEnable*/ false);
+    PORTD = (PORTD & 0x1F) | ((data[i] & 0x07) << 5);
+    PORTB = (PORTB & 0xE0) | (data[i] >> 3);
+    PORTB &= ~(1 << 5);
+    delayMicroseconds(1);
+    PORTB |= (1 << 5);
+  }
+  waitWriteComplete(address + len - 1, data[len - 1]);
 }
 
 
@@ -169,6 +256,50 @@ void writeVerify(int adr, int val) {
 }
 
 
+/* ------------------------------------------------------------------------------------------ *
+ * Write a block of bytes into EEPROM one page at a time and verify the result.
+ * Bytes that do not read back correctly, for instance because the EEPROM has
+ * no page mode, are written again one by one with writeVerify.
+ * -------------------------------------------------------------------------------------------*/
+void writeBlockVerify(int adr, byte *data, int len) {
+  int done = 0;
+  while (done < len) {
+    int count = PAGE_SIZE - ((adr + done) % PAGE_SIZE);
+    if (count > len - done) {
+      count = len - done;
+    }
+    writePage(adr + done, data + done, count);
+    for (int i = done; i < done + count; i += 1) {
+      if (readEEPROM(adr + i) != data[i]) {
+        writeVerify(adr + i, data[i]);
+      }
+    }
+    done += count;
+  }
+}
+
+
+/* ------------------------------------------------------------------------------------------ *
+ * Fill len bytes of the EEPROM from adr with a repeating pattern of 8 bytes,
+ * one page at a time, the pattern starting over at adr.
+ * -------------------------------------------------------------------------------------------*/
+void fillPattern(int adr, int len, byte *pattern) {
+  byte page[PAGE_SIZE];
+  int done = 0;
+  while (done < len) {
+    int count = PAGE_SIZE - ((adr + done) % PAGE_SIZE);
+    if (count > len - done) {
+      count = len - done;
+    }
+    for (int i = 0; i < count; i += 1) {
+      page[i] = pattern[(done + i) % 8];
+    }
+    writeBlockVerify(adr + done, page, count);
+    done += count;
+  }
+}
+
+
 /* ------------------------------------------------------------------------------------------ *
  * Read the contents of the EEPROM and print them to the serial monitor.
  * -------------------------------------------------------------------------------------------*/
@@ -199,9 +330,11 @@ void printContents(int start, int len) {
  * -------------------------------------------------------------------------------------------*/
 void eraseEEPROM() {
   // Erase entire EEPROM
+  byte zeroes[PAGE_SIZE];
+  memset(zeroes, 0x00, PAGE_SIZE);
   Serial.println("Erasing EEPROM");
-  for (int address = 0; address <= 8191; address += 1) {
-    writeVerify(address, 0x00);
+  for (int address = 0; address <= 8191; address += PAGE_SIZE) {
+    writeBlockVerify(address, zeroes, PAGE_SIZE);
 
     if (address % 256 == 0) {
       char buf[10];
@@ -213,6 +346,46 @@ void eraseEEPROM() {
 }
 
 
+/* ------------------------------------------------------------------------------------------ *
+ * CRC-16/CCITT (polynomial 0x1021, initial value 0xFFFF) for binary frames
+ * -------------------------------------------------------------------------------------------*/
+uint16_t crc16Update(uint16_t crc, byte data) {
+  crc ^= (uint16_t)data << 8;
+  for (int bit = 0; bit < 8; bit++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+  }
+  return crc;
+}
+
+uint16_t crc16(byte *data, int len) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < len; i++) {
+    crc = crc16Update(crc, data[i]);
+  }
+  return crc;
+}
+
+
+/* ------------------------------------------------------------------------------------------ *
+ * Send the contents of the EEPROM as raw bytes: a header line "RB aaaa llll",
+ * the bytes and their CRC-16/CCITT, high byte first
+ * -------------------------------------------------------------------------------------------*/
+void sendContents(int start, int len) {
+  char hdr[20];
+  sprintf(hdr, "RB %04x %04x", start, len);
+  Serial.println(hdr);
+
+  uint16_t crc = 0xFFFF;
+  for (int address = start; address < start+len; address += 1) {
+    byte data = readEEPROM(address);
+    Serial.write(data);
+    crc = crc16Update(crc, data);
+  }
+  Serial.write(crc >> 8);
+  Serial.write(crc & 0xFF);
+}
+
+
 /* ------------------------------------------------------------------------------------------ *
  * Hex to int routine
  * -------------------------------------------------------------------------------------------*/
@@ -246,7 +419,7 @@ int x2i(char *s)
 void setup() {
 
   // Set up serial communications:
-  Serial.begin(57600);
+  Serial.begin(BASE_SPEED);
   Serial.println("\tArduino starts");
 
   // Set pins:
@@ -275,6 +448,15 @@ void loop() {
       break;
       
     case FIL:                           // Filling the buffer
+      if (speedPending && millis() - speedTime > SPEED_TIMEOUT) {
+        speedPending = false;           // no command at the new speed, fall back
+        speed = BASE_SPEED;
+        Serial.end();
+        Serial.begin(speed);
+        ptr = 0;
+        state = RDY;
+        break;
+      }
       if (Serial.available() > 0) {
         char c = Serial.read();
         buf[ptr++] = c;
@@ -283,6 +465,10 @@ void loop() {
       if (ptr > 79) {
         strcpy(errtxt, "Received more than 80 characters, buffer purged");
         state = ERR;
+      } else if (ptr == 2 && buf[0] == 'W' && buf[1] == 'B') {
+        blkPtr = 0;                     // binary frame follows
+        blkTime = millis();
+        state = BIN;
       } else {
         if ( buf[ptr - 1] == '!' ) {
           buf[--ptr] = 0;
@@ -293,6 +479,31 @@ void loop() {
       }
       break;
       
+    case BIN:                           // Receiving a binary Write frame
+      if (Serial.available() > 0) {
+        blk[blkPtr++] = Serial.read();
+        blkTime = millis();
+        if (blkPtr == 3 && (blk[2] == 0 || blk[2] > PAGE_SIZE)) {
+          strcpy(errtxt, "Invalid length for Write Binary command");
+          state = ERR;
+        } else if (blkPtr > 3 && blkPtr == blk[2] + 5) {
+          adr = (blk[0] << 8) | blk[1];
+          Len = blk[2];
+          if (crc16(blk, Len + 3) != ((blk[Len + 3] << 8) | blk[Len + 4])) {
+            strcpy(errtxt, "Checksum error in Write Binary command");
+            state = ERR;
+          } else {
+            strcpy(cmd, "WB");
+            cc = WBI;
+            state = PRC;
+          }
+        }
+      } else if (millis() - blkTime > 1000) {
+        strcpy(errtxt, "Incomplete Write Binary command");
+        state = ERR;
+      }
+      break;
+      
     case CHK:                           // Checking buffer contents
       strcpy(command, buf);
       if (strlen(command) >= 2) {
@@ -305,7 +516,12 @@ void loop() {
         cc = 0;
         if      (strcmp(cmd, "CL") == 0) cc = CLR;
         else if (strcmp(cmd, "RD") == 0) cc = REA;
+        else if (strcmp(cmd, "RB") == 0) cc = RBI;
         else if (strcmp(cmd, "WR") == 0) cc = WRI;
+        else if (strcmp(cmd, "FP") == 0) cc = FPA;
+        else if (strcmp(cmd, "SP") == 0) cc = SPD;
+        else if (strcmp(cmd, "EC") == 0) cc = ECH;
+        else if (strcmp(cmd, "SK") == 0) cc = SKP;
         else if (strcmp(cmd, "QT") == 0) cc = QUI;
         
         if (cc != 0) {
@@ -316,6 +532,7 @@ void loop() {
               break;
 
             case REA:
+            case RBI:
               if (strlen(command) < 11) {
                 strcpy(errtxt, "Insufficient operands for Read command");
                 state = ERR;
@@ -346,6 +563,35 @@ void loop() {
               }
               break;
               
+            case SPD:
+              if (strlen(command) < 4) {
+                strcpy(errtxt, "Insufficient operands for Speed command");
+                state = ERR;
+              } else {
+                state = PRC;
+              }
+              break;
+              
+            case FPA:
+              if (strlen(command) < 35) {
+                strcpy(errtxt, "Insufficient operands for Fill command");
+                state = ERR;
+              } else {
+                // get operands (adr, length plus eight values)
+                strncpy(strAdr,(command+3),4);
+                strncpy(strLen,(command+8),4);
+                strncpy(strOp1,(command+13),2);
+                strncpy(strOp2,(command+16),2);
+                strncpy(strOp3,(command+19),2);
+                strncpy(strOp4,(command+22),2);
+                strncpy(strOp5,(command+25),2);
+                strncpy(strOp6,(command+28),2);
+                strncpy(strOp7,(command+31),2);
+                strncpy(strOp8,(command+34),2);
+                state = PRC;
+              }
+              break;
+              
             default:
               state = PRC;
               break;
@@ -389,6 +635,17 @@ void loop() {
           Serial.println("< ");
           break;
         
+        case RBI:                       // Processing Read Binary command
+          if (debug) Serial.println("Reading binary");
+          
+          adr = x2i(strAdr);
+          Len = x2i(strLen);
+          
+          sendContents(adr, Len);
+          
+          Serial.println(" <");
+          break;
+        
         case WRI:                       // Processing Write command
           if (debug) Serial.print("Writing ");
           
@@ -419,6 +676,66 @@ void loop() {
           Serial.println(" <");
           break;
         
+        case WBI:                       // Processing Write Binary command
+          if (debug) Serial.print("Writing binary ");
+          
+          char wbt[20];
+          sprintf(wbt, "WB %04x %02x", adr, Len);
+          Serial.print(wbt);
+          
+          writeBlockVerify(adr, blk + 3, Len);
+          
+          Serial.println(" <");
+          break;
+        
+        case FPA:                       // Processing Fill Pattern command
+          if (debug) Serial.print("Filling ");
+          
+          adr = x2i(strAdr);
+          Len = x2i(strLen);
+          byte pattern[8];
+          pattern[0] = x2i(strOp1);
+          pattern[1] = x2i(strOp2);
+          pattern[2] = x2i(strOp3);
+          pattern[3] = x2i(strOp4);
+          pattern[4] = x2i(strOp5);
+          pattern[5] = x2i(strOp6);
+          pattern[6] = x2i(strOp7);
+          pattern[7] = x2i(strOp8);
+          
+          char fpt[20];
+          sprintf(fpt, "FP %04x %04x", adr, Len);
+          Serial.print(fpt);
+          
+          fillPattern(adr, Len, pattern);
+          
+          Serial.println(" <");
+          break;
+        
+        case SPD:                       // Processing Speed command
+          if (debug) Serial.print("Speed ");
+          
+          char spt[20];
+          sprintf(spt, "SP %ld <", atol(command + 3));
+          Serial.println(spt);
+          Serial.flush();                 // send it at the old speed
+          speed = atol(command + 3);
+          Serial.end();
+          Serial.begin(speed);
+          speedPending = true;
+          speedTime = millis();
+          break;
+        
+        case ECH:                       // Processing Echo command
+          Serial.print(command);
+          Serial.println(" <");
+          break;
+        
+        case SKP:                       // Processing Speed Keep command
+          speedPending = false;
+          Serial.println("SK <");
+          break;
+        
         case QUI:                       // Processing Quit command
           Serial.println("\tArduino ends <");
           delay(20);
@@ -0,0 +1,383 @@
+#!/usr/bin/python
+
+# ------------------------------------------------------------------------
+# Program		:	gaw_eeprom_benchmark.py
+#
+# Function		:	measure how fast gaw_eeprom_programmer.py programs,
+#					reads and shows the microcode, against the simulated
+#					Arduino programmer, and keep the numbers as JSON to
+#					compare releases
+#
+# ------------------------------------------------------------------------
+# 						GNU LICENSE CONDITIONS
+# ------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# ------------------------------------------------------------------------
+#				Copyright (C) 2017 Gerard Wassink
+# ------------------------------------------------------------------------
+
+import sys
+import json
+import time
+import platform
+import argparse
+import serial
+
+import gaw_eeprom_programmer as programmer
+from gaw_eeprom_simulator import Simulator
+
+
+#
+# === Output that goes nowhere, to time the formatting of SH by itself
+#
+class Discard(object):
+
+	def write(self, text):
+		pass
+
+	def flush(self):
+		pass
+
+
+#
+# === Value at fraction p of the sorted samples
+#
+def percentile(samples, p):
+	if not samples:
+		return 0.0
+	ordered = sorted(samples)
+	return ordered[int(round(p * (len(ordered) - 1)))]
+
+
+#
+# === Serial port that notes when each command was last written, so the
+#		latency of a command runs from its (re)send to its completion
+#
+class TimedSerial(object):
+
+	def __init__(self, ser):
+		self.ser = ser
+		self.sentAt = {}
+
+	def write(self, data):
+		self.sentAt[data] = time.time()
+		return self.ser.write(data)
+
+	def __getattr__(self, name):
+		return getattr(self.ser, name)
+
+	def __setattr__(self, name, value):
+		if name in ("ser", "sentAt"):
+			object.__setattr__(self, name, value)
+		else:
+			setattr(self.ser, name, value)
+
+
+#
+# === Run the benchmarks against one simulated programmer
+#
+#	The simulator runs in this process; its counters split the time of
+#	each run into bytes on the serial line, EEPROM write cycles and the
+#	rest, which is the host and the Arduino handling the commands.
+#
+class Bench(object):
+
+	def __init__(self, baud, writeCycle, pageMode):
+		self.baud = baud
+		self.simulator = Simulator(baud, writeCycle, pageMode)
+		self.timed = TimedSerial(serial.Serial(self.simulator.start(), baud))
+		self.link = programmer.SerialLink(self.timed)
+		self.link.waitForPrompt(timeout=10, echo=False)
+		programmer.link = self.link
+
+
+	def close(self):
+		try:
+			self.link.processCommand("QT !", echo=False)
+		except programmer.ProgrammerError:
+			pass
+		self.timed.ser.close()
+		self.simulator.stop()
+
+
+	#
+	# === Time an operation, returns the result entry for it
+	#
+	#	run is called with a list to append the latency of every command
+	#	to and returns the number of commands and the bytes they moved;
+	#	host is the time spent before it building the commands
+	#
+	def measure(self, name, operation, mode, opcodes, run, host=0.0):
+		statistics = dict(self.simulator.statistics)
+		latencies = []
+		start = time.time()
+		commands, count = run(latencies)
+		seconds = time.time() - start + host
+		delta = dict((key, self.simulator.statistics[key] - statistics[key])
+			for key in statistics)
+		wire = self.simulator.wire(delta["received"] + delta["sent"])
+		eeprom = delta["writeCycles"] * self.simulator.writeCycle
+		return {
+			"name": name,
+			"operation": operation,
+			"mode": mode,
+			"baud": self.baud,
+			"opcodes": opcodes,
+			"commands": commands,
+			"bytes": count,
+			"seconds": round(seconds, 4),
+			"commandsPerSecond": round(commands / max(seconds, 1e-6), 1),
+			"bytesPerSecond": round(count / max(seconds, 1e-6), 1),
+			"latencyMs": {
+				"p50": round(1000 * percentile(latencies, 0.50), 2),
+				"p99": round(1000 * percentile(latencies, 0.99), 2),
+				"max": round(1000 * max(latencies or [0]), 2),
+			},
+			"phases": {
+				"host": round(host, 4),
+				"serial": round(wire, 4),
+				"eeprom": round(eeprom, 4),
+				"other": round(max(seconds - host - wire - eeprom, 0.0), 4),
+			},
+			"dropped": delta["dropped"],
+		}
+
+
+	#
+	# === Write the first opcodes of the given ROM sections
+	#
+	#	The snapshot handed to planWrite differs from the image in exactly
+	#	those opcodes, so only they are planned, as D0 - D2 would.
+	#
+	def write(self, name, operation, roms, mode, opcodes):
+		programmer.writeMode = mode
+		start = time.time()
+		programmer.invalidateImages()
+		plans = []
+		for rom in roms:
+			old = bytearray(programmer.romImage(rom))
+			for i in range(0, opcodes << 3):
+				old[i] ^= 0xFF
+			plans.append(programmer.planWrite(rom, old))
+		host = time.time() - start
+		def run(latencies):
+			for commands, count, skipped in plans:
+				def progress(done, total, commands=commands):
+					latencies.append(time.time() - self.timed.sentAt[commands[done - 1]])
+				self.link.sendCommands(commands, echo=False, progress=progress)
+			return (sum(len(p[0]) for p in plans), sum(p[1] for p in plans))
+		return self.measure(name, operation, mode, opcodes, run, host)
+
+
+	#
+	# === Read the first opcodes of CU0, one command per 8 opcodes, as text
+	#		with RD or in binary with RB
+	#
+	def read(self, name, operation, opcodes):
+		def run(latencies):
+			count = 0
+			for offset in range(0, opcodes << 3, 64):
+				length = min(64, (opcodes << 3) - offset)
+				start = time.time()
+				if operation == "RD":
+					self.link.processCommand("RD %04X %04X !" % (offset, length),
+						echo=False)
+				else:
+					self.link.readBlock(offset, length)
+				latencies.append(time.time() - start)
+				count += length
+			return ((count + 63) // 64, count)
+		return self.measure(name, operation, operation, opcodes, run)
+
+
+#
+# === Time SH for the first opcodes, host only, output discarded
+#
+def show(opcodes, repeat):
+	latencies = []
+	saved = sys.stdout
+	sys.stdout = Discard()
+	try:
+		start = time.time()
+		for i in range(0, repeat):
+			begin = time.time()
+			programmer.showInstructions(0, opcodes)
+			latencies.append(time.time() - begin)
+		seconds = time.time() - start
+	finally:
+		sys.stdout = saved
+	return {
+		"name": "SH %d" % opcodes,
+		"operation": "SH",
+		"mode": "host",
+		"baud": 0,
+		"opcodes": opcodes,
+		"commands": repeat,
+		"bytes": 0,
+		"seconds": round(seconds, 4),
+		"commandsPerSecond": round(repeat / max(seconds, 1e-6), 1),
+		"bytesPerSecond": 0.0,
+		"latencyMs": {
+			"p50": round(1000 * percentile(latencies, 0.50), 3),
+			"p99": round(1000 * percentile(latencies, 0.99), 3),
+			"max": round(1000 * max(latencies), 3),
+		},
+		"phases": {"host": round(seconds, 4), "serial": 0.0, "eeprom": 0.0, "other": 0.0},
+		"dropped": 0,
+	}
+
+
+#
+# === Run all combinations of operation, baud rate, mode and table size
+#
+def runBenchmarks(args):
+	operations = args.operations.split(",")
+	sizes = [int(s) for s in args.sizes.split(",")]
+	results = []
+	if "SH" in operations:
+		for opcodes in sizes:
+			results.append(show(opcodes, args.repeat))
+			report(results[-1])
+	for baud in [int(b) for b in args.bauds.split(",")]:
+		bench = Bench(baud, args.write_cycle / 1000.0, not args.no_page)
+		try:
+			for opcodes in sizes:
+				for operation in operations:
+					if operation in ("W0", "FL"):
+						roms = [0]
+						if operation == "FL":
+							roms = [0, 1, 2]
+						for mode in args.modes.split(","):
+							results.append(bench.write("%s %s %d %d" % (operation, mode,
+								baud, opcodes), operation, roms, mode, opcodes))
+							report(results[-1])
+					elif operation in ("RD", "RB"):
+						results.append(bench.read("%s %d %d" % (operation, baud, opcodes),
+							operation, opcodes))
+						report(results[-1])
+		finally:
+			bench.close()
+	if args.full_baud:						# all of FL at full speed
+		bench = Bench(args.full_baud, args.write_cycle / 1000.0, not args.no_page)
+		try:
+			for mode in args.modes.split(","):
+				results.append(bench.write("FL %s %d 256" % (mode, args.full_baud), "FL",
+					[0, 1, 2], mode, 256))
+				report(results[-1])
+		finally:
+			bench.close()
+	return results
+
+
+#
+# === Print one result as a line of the table
+#
+def report(result):
+	print "# === %-20s %6d cmds %7.2f s %8.1f cmds/s %8.0f bytes/s  p50 %7.2f ms  p99 %7.2f ms" % (
+		result["name"], result["commands"], result["seconds"],
+		result["commandsPerSecond"], result["bytesPerSecond"],
+		result["latencyMs"]["p50"], result["latencyMs"]["p99"])
+	phases = result["phases"]
+	if result["operation"] != "SH":
+		print "# ===   host %.3f s  serial %.3f s  eeprom %.3f s  other %.3f s  dropped %d" % (
+			phases["host"], phases["serial"], phases["eeprom"], phases["other"],
+			result["dropped"])
+	sys.stdout.flush()
+
+
+#
+# === Compare with the results of an earlier run, returns the names of
+#		the benchmarks that got slower by more than tolerance
+#
+def compareResults(results, path, tolerance):
+	f = open(path)
+	try:
+		earlier = dict((r["name"], r) for r in json.load(f)["results"])
+	finally:
+		f.close()
+	slower = []
+	for result in results:
+		old = earlier.get(result["name"])
+		if old is None:
+			continue
+		if result["seconds"] > old["seconds"] * (1.0 + tolerance):
+			print "# === SLOWER %-20s %.3f s, was %.3f s" % (result["name"],
+				result["seconds"], old["seconds"])
+			slower.append(result["name"])
+	if not slower:
+		print "# === No benchmark slower than %s by more than %d%%" % (path, 100 * tolerance)
+	return slower
+
+
+#
+# === Run the benchmarks and write the results
+#
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="gaw_eeprom_benchmark",
+		description="Benchmark gaw_eeprom_programmer against the simulated Arduino "
+			"programmer and write the results as JSON.")
+	parser.add_argument("--operations", default="W0,FL,RD,RB,SH",
+		help="comma separated operations to time (default W0,FL,RD,RB,SH)")
+	parser.add_argument("--sizes", default="16,64",
+		help="comma separated numbers of opcodes to write, read or show (default 16,64)")
+	parser.add_argument("--bauds", default="57600,115200",
+		help="comma separated serial speeds (default 57600,115200)")
+	parser.add_argument("--modes", default="WR,WB",
+		help="comma separated write modes (default WR,WB)")
+	parser.add_argument("--write-cycle", type=float, default=5.0,
+		help="milliseconds per simulated EEPROM write cycle (default 5)")
+	parser.add_argument("--no-page", action="store_true",
+		help="simulate an EEPROM without page write mode")
+	parser.add_argument("--full-baud", type=int, default=1000000,
+		help="speed of a run of all of FL, which must not drop a byte (default "
+			"1000000, 0 skips it)")
+	parser.add_argument("--repeat", type=int, default=50,
+		help="times SH is run per size (default 50)")
+	parser.add_argument("--output", default="benchmark.json",
+		help="JSON file for the results (default benchmark.json)")
+	parser.add_argument("--compare",
+		help="JSON file of an earlier run to compare with")
+	parser.add_argument("--tolerance", type=float, default=0.10,
+		help="fraction a benchmark may get slower before it counts (default 0.10)")
+	args = parser.parse_args(argv)
+	print "# === Program gaw_eeprom_benchmark starts"
+	results = runBenchmarks(args)
+	f = open(args.output, "w")
+	try:
+		json.dump({
+			"program": "gaw_eeprom_benchmark",
+			"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"writeCycleMs": args.write_cycle,
+			"pageMode": not args.no_page,
+			"results": results,
+		}, f, indent=1, sort_keys=True)
+	finally:
+		f.close()
+	print "# === Results written to", args.output
+	dropped = [result["name"] for result in results if result["dropped"]]
+	for name in dropped:
+		print "# === DROPPED bytes in", name
+	if args.compare and compareResults(results, args.compare, args.tolerance):
+		return 1
+	if dropped:
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
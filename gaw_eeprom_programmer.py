@@ -30,442 +30,1582 @@
 #				Copyright (C) 2015 Gerard Wassink
 # ------------------------------------------------------------------------
 
+import os
 import sys
 import time
+import string
+import threading
+import Queue
+import argparse
+import hashlib
+import binascii
 import serial
- 
-#
-# Define the values for the control signals
-#
- 
-# EEPROM 2, bits D23 - D16
- 
-CE      = 1 << 23  # 0x800000 - Count Enable
-HLT     = 1 << 22  # 0x400000 - Halt
-PCI     = 1 << 21  # 0x200000 - PC In
-PCO     = 1 << 20  # 0x100000 - PC Out
-MAI     = 1 << 19  # 0x080000 - Memory Address In
-MI      = 1 << 18  # 0x040000 - Memory In
-MO      = 1 << 17  # 0x020000 - Memory Out
-IRI     = 1 << 16  # 0x010000 - Instruction Register In
- 
-# EEPROM 1, bits D15 - D08
- 
-EO      = 1 << 15  # 0x008000 - Sigma Out (ALU value)
-OI      = 1 << 14  # 0x004000 - Output In
-AI      = 1 << 13  # 0x002000 - A Register In
-AO      = 1 << 12  # 0x001000 - A register Out
-BI      = 1 << 11  # 0x000800 - B register In
-BO      = 1 << 10  # 0x000400 - B register Out
-ALM     = 1 <<  9  # 0x000200 - ALU Mode
-AL0     = 1 <<  8  # 0x000100 - ALU function 0
- 
-# EEPROM 0, bits D07 - D00
- 
-AL1     = 1 <<  7  # 0x000080 - ALU function 1
-AL2     = 1 <<  6  # 0x000040 - ALU function 2
-AL3     = 1 <<  5  # 0x000020 - ALU function 3
-ALCI    = 1 <<  4  # 0x000010 - ALU Carry In
-n3      = 1 <<  3  # 0x000008 - 
-n2      = 1 <<  2  # 0x000004 - 
-n1      = 1 <<  1  # 0x000002 - 
-RSC     = 1 <<  0  # 0x000001 - Reset Step Counter on CU for Microcode Steps
- 
-#
-#   Constant control words for Fetch cycle in every instruction
-#
-CW_0    = MAI | PCO
-CW_1    = MO | IRI | CE
- 
-#
-# Define the control words per machine code instruction
-# 256 instructions x 8 bytes = 2K bytes
-#
- 
-instr = {
-#
-# === NO Operation
-#
-  0x00: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-#
-# === LOAD instructions
-#
-  0x01: [ CW_0, CW_1, PCO|MAI,                MO|CE|AI,           RSC,                    0,                          0,  0, ], # LDAi val
-  0x02: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|AI|CE,               RSC,                        0,  0, ], # LDAm addr
-
-  0x03: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x04: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x05: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x06: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
- 
-  0x07: [ CW_0, CW_1, PCO|MAI,                MO|CE|BI,           RSC,                    0,                          0,  0, ], # LDBi val
-  0x08: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI|CE,               RSC,                        0,  0, ], # LDBm addr
-
-  0x09: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x0A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x0B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x0C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x0D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x0E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x0F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-# 
-# === STORE instructions
-#
-  0x10: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             AO|MI|CE,               RSC,                        0,  0, ], # STAm addr
-  0x11: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             BO|MI|CE,               RSC,                        0,  0, ], # STBm addr
-
-  0x12: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x13: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x14: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x15: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x16: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x17: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x18: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x19: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x1A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x1B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x1C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x1D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x1E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x1F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-#
-# === ARITHMETIC instructions
-#
-  0x20: [ CW_0, CW_1, AL3|AL0|EO|AI|CE,       RSC,                0,                      0,                          0,  0, ], # ADD
-  0x21: [ CW_0, CW_1, PCO|MAI,                MO|BI,              AL3|AL0|EO|AI|CE,       RSC,                        0,  0, ], # ADDi val
-  0x22: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI,                  AL3|AL0|EO|AI|CE,           RSC,0, ], # ADDm addr
-
-  0x23: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x24: [ CW_0, CW_1, AL2|AL1|EO|AI|CE,       RSC,                0,                      0,                          0,  0, ], # SUB
-  0x25: [ CW_0, CW_1, PCO|MAI,                MO|BI,              AL2|AL1|EO|AI|CE,       RSC,                        0,  0, ], # SUBi val
-  0x26: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI,                  AL2|AL1|EO|AI|CE,           RSC,0, ], # SUBm addr
-
-  0x27: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
- 
-  0x28: [ CW_0, CW_1, AO|BI,                  ALM|AL3|AL2|EO|AI,  AL3|AL0|EO|AI,          AO|BI,                      RSC,0, ], # INCA
-  0x29: [ CW_0, CW_1, ALM|AL3|AL2|EO|AI,      AL3|AL0|EO|AI,      AO|BI,                  RSC,                        0,  0, ], # INCB
-
-  0x2A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x2B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x2C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x2D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x2E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x2F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-#
-# === LOGIC instructions
-#
-  0x30: [ CW_0, CW_1, ALM|AL2|AL1|EO|AI|CE,   RSC,                0,                      0,                          0,  0, ], # XOR
-  0x31: [ CW_0, CW_1, PCO|MAI,                MO|BI,              ALM|AL2|AL1|EO|AI|CE,   RSC,                        0,  0, ], # XORi val
-  0x32: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI,                  ALM|AL2|AL1|EO|AI|CE,       RSC,0, ], # 0x32 - XORm mem
-
-  0x33: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
- 
-  0x34: [ CW_0, CW_1, ALM|AL3|AL1|AL0|EO|AI|CE,   RSC,            0,                      0,                          0,  0, ], # AND
-  0x35: [ CW_0, CW_1, PCO|MAI,                MO|BI,              ALM|AL3|AL1|AL0|EO|AI|CE,   RSC,                    0,  0, ], # ANDi val
-  0x36: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI,                  ALM|AL3|AL1|AL0|EO|AI|CE,   RSC,0, ], # ANDm mem
- 
-  0x37: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x38: [ CW_0, CW_1, ALM|AL3|AL2|AL1|EO|AI|CE,   RSC,            0,                      0,                          0,  0, ], # OR
-  0x39: [ CW_0, CW_1, PCO|MAI,                MO|BI,              ALM|AL3|AL2|AL1|EO|AI|CE,   RSC,                    0,  0, ], # ORi val
-  0x3A: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI,                  ALM|AL3|AL2|AL1|EO|AI|CE,   RSC,0, ], # ORm mem
- 
-  0x3B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x3C: [ CW_0, CW_1, ALM|EO|AI,              RSC,                0,                      0,                          0,  0, ], # NOTA
-  0x3D: [ CW_0, CW_1, ALM|AL2|AL0|EO|BI,      RSC,                0,                      0,                          0,  0, ], # NOTB
-  0x3E: [ CW_0, CW_1, ALM|AL1|AL0|EO|AI,      RSC,                0,                      0,                          0,  0, ], # CLRA
-  0x3F: [ CW_0, CW_1, ALM|AL1|AL0|EO|BI,      RSC,                0,                      0,                          0,  0, ], # CLRB
-#
-# === JUMP instructions
-#
-  0x40: [ CW_0, CW_1, PCO|MAI,                MO|PCI,             RSC,                    0,                          0,  0, ], # JMPi val
-  0x41: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|PCI,                 RSC,                        0,  0, ], # JMPm addr
-
-  0x42: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x43: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x44: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x45: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x46: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x47: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x48: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x49: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x4A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x4B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x4C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x4D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x4E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x4F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-#
-# === OUTPUT instructions
-#
-  0x50: [ CW_0, CW_1, AO|OI,                  RSC,                0,                      0,                          0,  0, ], # OUTA
-  0x51: [ CW_0, CW_1, BO|OI,                  RSC,                0,                      0,                          0,  0, ], # OUTB
- 
-  0x52: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x53: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x54: [ CW_0, CW_1, PCO|MAI,                MO|OI|CE,           RSC,                    0,                          0,  0, ], # OUTi
-  0x55: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|OI|CE,               RSC,                        0,  0, ], # OUTm
-
-  0x56: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x57: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x58: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x59: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x5A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x5B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x5C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x5D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x5E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x5F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-#
-# === MOVE instructions
-#
-  0x60: [ CW_0, CW_1, PCO|MAI,                MO|BI|CE,           PCO|MAI,                BO|MI|CE,                   RSC,0, ], # MOVi val
-  0x61: [ CW_0, CW_1, PCO|MAI,                MO|MAI,             MO|BI|CE,               PCO|MAI,            BO|MI|CE, RSC, ], # MOVm ad1, ad2
-
-  0x62: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x63: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x64: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x65: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x66: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x67: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x68: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x69: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x6A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x6B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x6C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x6D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x6E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x6F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x70: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x71: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x72: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x73: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x74: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x75: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x76: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x77: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x78: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x79: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x7A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x7B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x7C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x7D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x7E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x7F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x80: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x81: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x82: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x83: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x84: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x85: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x86: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x87: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x88: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x89: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x8A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x8B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x8C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x8D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x8E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x8F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0x90: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x91: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x92: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x93: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x94: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x95: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x96: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x97: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x98: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x99: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x9A: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x9B: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x9C: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x9D: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x9E: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0x9F: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0xA0: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA1: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA2: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA3: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA4: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA5: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA6: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA7: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA8: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xA9: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xAA: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xAB: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xAC: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xAD: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xAE: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xAF: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0xB0: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB1: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB2: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB3: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB4: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB5: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB6: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB7: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB8: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xB9: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xBA: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xBB: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xBC: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xBD: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xBE: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xBF: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0xC0: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC1: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC2: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC3: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC4: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC5: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC6: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC7: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC8: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xC9: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xCA: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xCB: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xCC: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xCD: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xCE: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xCF: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0xD0: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD1: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD2: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD3: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD4: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD5: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD6: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD7: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD8: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xD9: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xDA: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xDB: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xDC: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xDD: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xDE: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xDF: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0xE0: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE1: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE2: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE3: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE4: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE5: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE6: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE7: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE8: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xE9: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xEA: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xEB: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xEC: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xED: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xEE: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xEF: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-
-  0xF0: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF1: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF2: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF3: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF4: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF5: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF6: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF7: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF8: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xF9: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xFA: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xFB: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xFC: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xFD: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-  0xFE: [ CW_0, CW_1, RSC,                    0,                  0,                      0,                          0,  0, ], # NOP
-#
-# === HALT instruction
-#
-  0xFF: [ MAI|PCO, MO|IRI|CE, HLT,            RSC,                0,                      0,                          0,  0, ] # HLT
-}
+
+import gaw_microcode
+import gaw_layout
+import gaw_hazards
+
+
+#
+# === Microcode source holding the control words per machine code
+#		instruction, 256 instructions x 8 steps = 2K control words with
+#		the default layout
+#
+microcodeFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microcode.txt")
+
+
+#
+# === Microcode compiled from microcodeFile, with the time and size of the
+#		file it was compiled from
+#
+microcode = None
+microcodeStamp = None
+
+
+#
+# === Directory holding a snapshot of the last image written per ROM section
+#
+snapshotDir = "snapshots"
+
+
+#
+# === Command used to write blocks: WR sends 8 bytes as hexadecimal text,
+#		WB sends up to a 64 byte page in a binary frame with a CRC
+#
+writeMode = "WB"
+
+
+#
+# === Runs of identical 8 byte blocks are written with one FP command when
+#		fillRuns is set and the run holds at least fillMinimum blocks for
+#		the write mode; shorter runs cost less as WR or WB
+#
+fillRuns = True
+fillMinimum = {"WR": 2, "WB": 5}
+
+
+#
+# === Speeds tried for the serial link after the Arduino started at the
+#		speed it always starts at, the fastest that works is kept;
+#		speedTimeout is the time it takes the Arduino to fall back from
+#		a speed that did not work (SPEED_TIMEOUT in the firmware)
+#
+linkRates = [1000000, 500000, 250000, 115200]
+speedTimeout = 2.0
+
+
+#
+# === Directory holding the backups of chips, taken before the first write
+#		to a chip without snapshots when autoBackup is set
+#
+backupDir = "backups"
+autoBackup = True
+
+
+#
+# === A write that loses the link reconnects for up to reconnectTimeout
+#		seconds, 0 does not, and continues after the last command the
+#		journal holds as acknowledged; with verifyResume the block in
+#		flight when the link failed is read back first
+#
+reconnectTimeout = 30.0
+verifyResume = False
+
+
+#
+# === Microcode is checked for hazards before it is programmed, with
+#		checkHazards microcode that has them is refused
+#
+checkHazards = True
+
+
+#
+# === Value of every byte of an EEPROM cleared with CL
+#
+erasedValue = 0x00
+
+
+#
+# === How the control words are laid out over the EEPROMs: 24 bit words
+#		of 8 steps for 256 opcodes, CU00 - CU02 holding a byte each in a
+#		2K section of an EEPROM with 4 of them, unless the command line
+#		says otherwise
+#
+layout = gaw_layout.Layout()
+
+
+#
+# === Compiled form of the instruction table
+#
+#	words holds the control word for each address of a section, images
+#	the image of each ROM section as the layout has it. They are built
+#	from the microcode and kept until the microcode changes or
+#	invalidateImages() is called. Writers, viewers and verifiers slice
+#	from them.
+#
+compiled = None
+
+
+#
+# === The compiled microcode, loaded again when its source file changed
+#
+#	Loading takes the compiled form from the cache when the source was
+#	compiled before, so an unchanged source costs one stat of the file.
+#
+def loadMicrocode():
+	global microcode, microcodeStamp, compiled
+	info = os.stat(microcodeFile)
+	stamp = (microcodeFile, info.st_mtime, info.st_size)
+	if microcode is None or stamp != microcodeStamp:
+		loaded = gaw_microcode.load(microcodeFile)
+		layout.check(loaded, microcodeFile)
+		if microcode is None or loaded.digest != microcode.digest:
+			compiled = None
+			print "# === Microcode %s %s" % (microcodeFile,
+				loaded.cached and "loaded from the cache" or "compiled")
+		microcode = loaded
+		microcodeStamp = stamp
+	return microcode
+
+
+#
+# === Hazards in compiled microcode, kept per hash of its source
+#
+hazardCache = {}
+
+
+def microcodeHazards(loaded):
+	if loaded.digest not in hazardCache:
+		hazardCache[loaded.digest] = gaw_hazards.analyze(loaded)
+	return hazardCache[loaded.digest]
+
+
+#
+# === Check microcode sources for hazards, the one in use by default,
+#		before programming them
+#
+#	With checkHazards a source with hazards is reported and refused,
+#	without it programming goes ahead with a warning.
+#
+def preflight(sources=None):
+	for path in sources or [microcodeFile]:
+		if path == microcodeFile:
+			loaded = loadMicrocode()
+		else:
+			loaded = gaw_microcode.load(path)
+		hazards = microcodeHazards(loaded)
+		if not hazards:
+			continue
+		if not checkHazards:
+			print "# === %s: %d hazard(s), programmed anyway" % (path, len(hazards))
+			continue
+		print "# === %s: %d hazard(s) in the microcode" % (path, len(hazards))
+		for line in gaw_hazards.report(loaded, hazards):
+			print line
+		raise ProgrammerError("%s has hazards, not programmed (--no-check or SET CHECK OFF to do so anyway)"
+			% path)
+
+
+#
+# === Check the microcode sources for hazards and report them, returns
+#		True when none were found
+#
+def checkMicrocode(sources=None):
+	clean = True
+	for path in sources or [microcodeFile]:
+		if path == microcodeFile:
+			loaded = loadMicrocode()
+		else:
+			loaded = gaw_microcode.load(path)
+		start = time.time()
+		hazards = gaw_hazards.analyze(loaded)
+		print "# === %s: %d hazard(s) in %d opcode(s), checked in %.1f ms" % (path,
+			len(hazards), len(gaw_hazards.byOpcode(hazards)), 1000 * (time.time() - start))
+		for line in gaw_hazards.report(loaded, hazards):
+			print line
+		clean = clean and not hazards
+	return clean
+
+
+#
+# === Split the control words into ROM images
+#
+def compileImages():
+	words = loadMicrocode().words			# 256 instructions x 8 steps
+	return (words, layout.images(words))	# byte 0 of every word for CU0 ...
+
+
+#
+# === Forget the compiled images, load the microcode again
+#
+def invalidateImages():
+	global compiled, microcodeStamp
+	compiled = None
+	microcodeStamp = None
+
+
+#
+# === Control words and ROM images, compiled when needed
+#
+def compiledImages():
+	global compiled
+	loadMicrocode()
+	if compiled is None:
+		compiled = compileImages()
+	return compiled
+
+
+#
+# === The 2K image of one ROM section, shared so not to be changed
+#
+def romImage(rom):
+	return compiledImages()[1][rom]
+
+
+#
+# === Microcode variants, one per 2K section of a chip
+#
+#	Instead of the three ROM sections on one EEPROM, each of the three
+#	EEPROMs can hold one byte of the control word, CU00 - CU02, for up
+#	to four microcode sources in its sections; SC1 and SC0 then select
+#	the variant on the board. variantFiles lists the sources per
+#	section, the microcode in use when it is empty; sections without a
+#	source are left erased.
+#
+variantFiles = []
+
+
+#
+# === Sources of the variants, section 0 first
+#
+def variantSources():
+	return variantFiles or [microcodeFile]
+
+
+#
+# === The image of the whole EEPROM holding byte lane of the control word
+#		of every variant
+#
+def variantChip(lane):
+	tables = []
+	for path in variantSources():
+		loaded = gaw_microcode.load(path)
+		layout.check(loaded, path)
+		tables.append(loaded.words)
+	return layout.chipImage(tables, lane, erasedValue)
+
+
+#
+# === Name of the snapshot file for the whole EEPROM of a byte lane
+#
+def chipSnapshotFile(lane):
+	return os.path.join(snapshotDir, "CU%02d_chip.bin" % lane)
+
+
+#
+# === Write the variants of a byte lane into the EEPROM in one pass and
+#		verify it, returns True when it matches
+#
+#	Only the blocks that differ from the snapshot of the chip are sent,
+#	so a section with an unchanged variant costs nothing. A chip without
+#	a snapshot is backed up first when autoBackup is set, what was read
+#	then serves as the snapshot. The snapshots of the ROM sections and
+#	of the other chips no longer hold once the chip is written, they are
+#	dropped before and set again from the chip when it is verified.
+#
+def writeChip(lane):
+	sources = variantSources()
+	if len(sources) > layout.sections:
+		raise ProgrammerError("At most %d variants fit in the sections of a chip"
+			% layout.sections)
+	preflight(sources)
+	image = variantChip(lane)
+	print "# ==="
+	print "# === Writing CU%02d, byte %d of %d microcode variant(s)" % (lane, lane, len(sources))
+	print "# ==="
+	old = loadImage(chipSnapshotFile(lane), layout.chipSize)
+	if old is None and autoBackup:
+		old = backupChip()
+	for section in range(0, layout.sections):
+		part = slice(layout.address(section, 0), layout.address(section + 1, 0))
+		state = "changed"
+		if old is not None and old[part] == image[part]:
+			state = "unchanged"
+		print "# === SC%d %-28s %s" % (section, section < len(sources) and sources[section]
+			or "(erased)", state)
+	link.resetTiming()
+	start = time.time()
+	commands, written, skipped = planImage(0, image, old)
+	journal = Journal("CU%02d_chip" % lane, commands, old)
+	resumed = journal.done
+	if resumed:
+		print "# === Resuming CU%02d after %d of %d commands" % (lane, resumed,
+			len(commands))
+	sending = bytesWritten(commands[resumed:])
+	progress = None
+	if sys.stdout.isatty():
+		def progress(done, total, begin=time.time()):
+			showBar("CU%02d" % lane, sending * (done - resumed) // max(total - resumed, 1),
+				sending, begin)
+	for rom in range(0, layout.chips):
+		dropSnapshot(rom)
+	dropChipSnapshots(lane)
+	runJob(0, image, journal, commands, echo=progress is None, progress=progress)
+	if progress and commands[resumed:]:
+		print ""
+	print "# === CU%02d: %d blocks written, %d blocks skipped" % (lane, sending // 8, skipped)
+	if resumed:
+		print "# === %d blocks were written before the write was resumed" % (
+			(written - sending) // 8)
+	return verifyChip(lane, image, start)
+
+
+#
+# === Verify the EEPROM of a byte lane against its variants, reading it
+#		back section by section; what was read becomes its snapshot and
+#		those of its ROM sections
+#
+def verifyChip(lane, image=None, start=None):
+	if image is None:
+		image = variantChip(lane)
+	start = start or time.time()
+	data = bytearray()
+	for section in range(0, layout.sections):
+		data += link.readBlock(layout.address(section, 0), layout.sectionSize)
+	dropChipSnapshots(lane)
+	saveImage(chipSnapshotFile(lane), data)
+	for rom in range(0, layout.chips):
+		saveSnapshot(rom, data[layout.address(rom, 0):layout.address(rom + 1, 0)])
+	elapsed = time.time() - start
+	if data == image:
+		print "# === CU%02d verified, all %d bytes match, %.1f s" % (lane, len(data), elapsed)
+		return True
+	print "# === CU%02d differs:" % lane
+	showMismatches(0, image, data)
+	return False
+
+
+#
+# === Build the WR command writing a block of 8 bytes at an address
+#
+def writeCommand(address, block):
+	return "WR %04X %s !" % (address, " ".join(["%02X" % value for value in block]))
+
+
+#
+# === Build the binary WB frame writing up to 64 bytes at an address
+#
+#	"WB", address high and low byte, length, the data and a CRC-16/CCITT
+#	over address, length and data, high byte first
+#
+def binaryCommand(address, block):
+	frame = bytearray([address >> 8, address & 0xFF, len(block)]) + block
+	crc = binascii.crc_hqx(str(frame), 0xFFFF)
+	return "WB" + str(frame) + chr(crc >> 8) + chr(crc & 0xFF)
+
+
+#
+# === Build the FP command filling length bytes at an address with a
+#		repeating pattern of 8 bytes
+#
+def fillCommand(address, length, pattern):
+	return "FP %04X %04X %s !" % (address, length,
+		" ".join(["%02X" % value for value in pattern]))
+
+
+#
+# === Plan the commands writing the image of a ROM section
+#
+#	Returns the commands, the number of bytes they write and the number
+#	of 8 byte blocks skipped because they equal those in old. A run of
+#	identical blocks, like the rows of all NOP instructions, is written
+#	with a single FP command.
+#
+def planWrite(rom, image, old=None):
+	return planImage(layout.address(rom, 0), image, old)	# a section per 'ROM'
+
+
+#
+# === Plan the commands writing an image at base, skipping the blocks
+#		that equal those in old
+#
+def planImage(base, image, old=None):
+	if old is None:
+		offsets = range(0, len(image), 8)	# blocks to write
+	else:
+		offsets = gaw_layout.changedBlocks(image, old)
+	skipped = len(image) // 8 - len(offsets)
+	runs = []								# [kind, offset, length] to write
+	i = 0
+	while i < len(offsets):
+		block = image[offsets[i]:offsets[i] + 8]	# block of 8 micro code steps
+		j = i + 1
+		while (j < len(offsets) and offsets[j] == offsets[j - 1] + 8
+				and image[offsets[j]:offsets[j] + 8] == block):
+			j += 1
+		if fillRuns and j - i >= fillMinimum[writeMode]:
+			runs.append(["FP", offsets[i], (j - i) * 8])
+			i = j
+			continue
+		for offset in offsets[i:j]:
+			if (writeMode == "WB" and runs and runs[-1][0] == "WB"
+					and runs[-1][1] + runs[-1][2] == offset
+					and offset % 64 != 0):		# same page as the previous block
+				runs[-1][2] += 8
+			else:
+				runs.append([writeMode, offset, 8])
+		i = j
+	commands = []
+	for kind, offset, length in runs:
+		if kind == "FP":
+			commands.append(fillCommand(base + offset, length, image[offset:offset + 8]))
+		elif kind == "WB":
+			commands.append(binaryCommand(base + offset, image[offset:offset + length]))
+		else:
+			commands.append(writeCommand(base + offset, image[offset:offset + length]))
+	return (commands, sum(length for kind, offset, length in runs), skipped)
 
 
 #
 # === Generate commands for the Arduino programmer
 #
-def writeEEPROM(rom):
-	base = rom << 11						# segments of 2048 bytes per 'ROM'
+#	With diff set, only the 8 byte blocks that differ from the snapshot
+#	of the section are sent, all other blocks are skipped. In WB mode
+#	consecutive blocks to send are joined into frames covering at most
+#	one 64 byte page of the EEPROM, which the Arduino writes in a single
+#	page write cycle.
+#
+#	On a terminal a progress bar with the speed and the time still to go
+#	replaces the responses of the Arduino, which are shown otherwise.
+#	A summary of where the time went closes the section.
+#
+#	The image is taken once, so a source edited during the write is
+#	programmed by the next one and never recorded as written.
+#
+def writeEEPROM(rom, diff=False):
+	preflight()
+	image = romImage(rom)
+	base = layout.address(rom, 0)			# a section per 'ROM'
 	print "# ==="
 	print "# === Writing contents of ROM ", rom, " base addres is 0x%04X" % base
 	print "# ==="
-	for op, contr in sorted(instr.iteritems()):	# iterate through instructions
-#		print "# === opcode 0x%02X" % op
-		address = base + (op << 3)			# block of 8 micro code steps
-		buffer = "WR %04X " % address		# base address for this instruction
-		for i in range(0, len(contr)):		# iterate through microcode steps and
-											# 	print only part for this ROM
-			toadd = str("%02X " % ((contr[i] >> (rom * 8)) & 0xFF))
-			buffer = buffer + toadd
-		toadd = str("!")
-		buffer = buffer + toadd				# comment and line end
-		processCommand(buffer)
-		time.sleep(.1)
+	if autoBackup and loadSnapshot(rom) is None:
+		data = backupChip()					# unknown chip, keep what is on it
+		for section in range(0, layout.chips):	# and start its snapshots
+			saveSnapshot(section, data[layout.address(section, 0):
+				layout.address(section + 1, 0)])
+	link.resetTiming()
+	start = time.time()
+	old = None
+	if diff:
+		old = loadSnapshot(rom)
+		if old is None:
+			print "# === No snapshot for ROM", rom, "- reading it from the EEPROM"
+			old = readSection(rom)
+	commands, written, skipped = planWrite(rom, image, old)
+	state = old
+	if state is None:
+		state = loadSnapshot(rom)
+	journal = Journal("CU%02d" % rom, commands, state)
+	resumed = journal.done
+	if resumed:
+		print "# === Resuming ROM %d after %d of %d commands" % (rom, resumed,
+			len(commands))
+	sending = bytesWritten(commands[resumed:])
+	host = time.time() - start
+	progress = None
+	if sys.stdout.isatty():
+		def progress(done, total, begin=time.time()):
+			showBar("CU%d" % rom, sending * (done - resumed) // max(total - resumed, 1),
+				sending, begin)
+	dropChipSnapshots()						# the chip no longer matches them
+	elapsed = runJob(base, image, journal, commands, echo=progress is None,
+		progress=progress)
+	if progress and commands[resumed:]:
+		print ""
+	saveSnapshot(rom, image)
+	print "# === ROM", rom, ": %d blocks written, %d blocks skipped" % (sending // 8, skipped)
+	if resumed:
+		print "# === %d blocks were written before the write was resumed" % (
+			(written - sending) // 8)
+	if commands[resumed:]:
+		print "# === %d bytes in %d commands, %.1f s, %.0f bytes/s" % (sending,
+			len(commands) - resumed, elapsed, sending / max(elapsed, 1e-6))
+		showTiming(time.time() - start, host)
 
 
 #
-# === find character in string
+# === Journal of the commands of a write acknowledged by the Arduino
+#
+#	Kept next to the snapshots as CU0n.journal, named after what is
+#	written: the hash of the planned commands and of state, the snapshot
+#	or backup of the chip they were planned against, then the number
+#	acknowledged after every acknowledgement.
+#	A write planned the same way against the same chip again, because
+#	the one before failed, starts after the last number; a different
+#	plan or a chip changed since starts over. Commands that change the
+#	chip otherwise remove the journals with forgetWrites().
 #
-def strfind(string, char):
-	r = False
-	for i in range(0, len(string)):
-		if string[i] == char:
-			r = True
-			break
-	return(r)
+class Journal(object):
+
+	def __init__(self, name, commands, state=None, directory=None):
+		self.path = os.path.join(directory or snapshotDir, name + ".journal")
+		digest = hashlib.sha1("".join(commands))
+		if state is not None:
+			digest.update("\n" + str(state))
+		self.digest = digest.hexdigest()
+		self.done = 0
+		self.f = None
+		try:
+			f = open(self.path)
+			try:
+				lines = f.read().split()
+			finally:
+				f.close()
+			if len(lines) > 1 and lines[0] == self.digest:
+				self.done = int(lines[-1])
+		except (IOError, ValueError):
+			pass							# no journal, or a damaged one
+
+
+	def open(self):
+		directory = os.path.dirname(self.path)
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.f = open(self.path, self.done and "a" or "w")
+		if not self.done:
+			self.f.write(self.digest + "\n")
+
+
+	def acknowledge(self, done):
+		self.done = done
+		self.f.write("%d\n" % done)
+		self.f.flush()
+
+
+	#
+	# === Close the journal, and remove it when the write completed
+	#
+	def close(self, complete=False):
+		if self.f:
+			self.f.close()
+			self.f = None
+		if complete and os.path.exists(self.path):
+			os.remove(self.path)
 
 
 #
-# === Wait for Arduino programmer to be ready
+# === Send the commands writing image at base from where their journal
+#		says they are, reconnecting and continuing when the link fails,
+#		returns the time it took
 #
-def waitForPrompt():
-	while True:
-		l = ser.readline()
-		print l[:(len(l)-1)]
-		if strfind(l, '>'):
-			break
-	time.sleep(.1)
+#	The link is given up when it fails again before any further command
+#	got acknowledged, more than link.retries times in a row.
+#
+def runJob(base, image, journal, commands, echo=True, progress=None):
+	start = time.time()
+	failures = 0
+	journal.open()
+	try:
+		while journal.done < len(commands):
+			done = journal.done
+			def acknowledged(count, total):
+				journal.acknowledge(done + count)
+				if progress:
+					progress(done + count, len(commands))
+			try:
+				link.sendCommands(commands[done:], echo, acknowledged)
+			except (ProgrammerError, serial.SerialException, EnvironmentError) as e:
+				if journal.done == done:
+					failures += 1
+				else:
+					failures = 1
+				if not reconnectTimeout or failures > link.retries:
+					raise
+				print ""
+				print "# === Link lost after %d of %d commands (%s), reconnecting" % (
+					journal.done, len(commands), e)
+				reconnectLink()
+				if verifyResume and journal.done < len(commands):
+					resumeBlock(base, image, journal, commands)
+	finally:
+		journal.close(journal.done >= len(commands))
+	return time.time() - start
 
 
 #
-# === Read and display responses until Arduino completed the action
+# === Read back the block of the command the link failed on, and count it
+#		as acknowledged when it already holds what the command writes
 #
-def waitForEndAction():
-	while True:
-		l = ser.readline ()
-		print l[:(len(l)-1)]
-		if strfind(l, '<'):
-			break
-	time.sleep(.1)
+def resumeBlock(base, image, journal, commands):
+	address, length = commandRange(commands[journal.done])
+	offset = address - base
+	if link.readBlock(address, length) == image[offset:offset + length]:
+		print "# === Block at 0x%04X was written before the link failed" % address
+		journal.acknowledge(journal.done + 1)
+	else:
+		print "# === Block at 0x%04X is incomplete, writing it again" % address
+
+
+#
+# === Number of bytes a series of WR, WB and FP commands writes
+#
+def bytesWritten(commands):
+	return sum(commandRange(command)[1] for command in commands)
+
+
+#
+# === Address and length of the bytes a WR, WB or FP command writes
+#
+def commandRange(command):
+	if command[:2] == "WB":
+		header = bytearray(command[2:5])
+		return ((header[0] << 8) | header[1], header[2])
+	fields = command.split()
+	if command[:2] == "FP":
+		return (int(fields[1], 16), int(fields[2], 16))
+	return (int(fields[1], 16), len(fields) - 3)
+
+
+#
+# === Draw a progress bar in place, with the speed and the time to go
+#
+def showBar(label, done, total, begin):
+	elapsed = max(time.time() - begin, 1e-6)
+	speed = done / elapsed
+	eta = (total - done) / max(speed, 1e-6)
+	width = 30 * done // max(total, 1)
+	sys.stdout.write("\r# === %s [%s%s] %3d%% %6.0f bytes/s  ETA %5.1f s " % (label,
+		"#" * width, "." * (30 - width), 100 * done // max(total, 1), speed, eta))
+	sys.stdout.flush()
+
+
+#
+# === Show where the time of the last operation on the link went
+#
+#	The serial line time is what the bytes sent and received take at the
+#	baud rate. When it fills most of the elapsed time the link sets the
+#	pace, otherwise the Arduino and the EEPROM write cycles do.
+#
+def showTiming(elapsed, host=0.0):
+	timing = link.timing
+	print "# === %.2f s: host %.2f s, writing %.2f s, waiting %.2f s, resync %.2f s" % (
+		elapsed, host, timing["write"], timing["wait"], timing["resync"])
+	line = 10.0 * (link.bytesOut + link.bytesIn) / link.ser.baudrate
+	if line > elapsed / 2:
+		pace = "the serial link sets the pace"
+	else:
+		pace = "the Arduino and the EEPROM set the pace"
+	print "# === %d bytes out, %d bytes in, serial line busy %.2f s (%.0f%%), %s" % (
+		link.bytesOut, link.bytesIn, line, 100 * line / max(elapsed, 1e-6), pace)
+
+
+#
+# === Measure the effective write speed at increasing window sizes
+#
+#	Rewrites the first 32 blocks of a ROM section with their own image,
+#	for every window size up to what the Arduino's serial buffer takes
+#
+def windowTest(rom):
+	base = layout.address(rom, 0)
+	image = romImage(rom)
+	if writeMode == "WB":
+		commands = [binaryCommand(base + offset, image[offset:offset + 8])
+			for offset in range(0, 256, 8)]
+	else:
+		commands = [writeCommand(base + offset, image[offset:offset + 8])
+			for offset in range(0, 256, 8)]
+	largest = 1 + link.rxBuffer // len(commands[0])
+	saved = link.inFlight
+	print "# === Window   Commands/s    Bytes/s   Serial bytes/s"
+	try:
+		for window in range(1, largest + 1):
+			link.inFlight = window
+			elapsed = max(link.sendCommands(commands, echo=False), 1e-6)
+			print "# === %6d %12.1f %10.0f %16.0f" % (window,
+				len(commands) / elapsed, 256 / elapsed,
+				sum(len(c) for c in commands) / elapsed)
+	finally:
+		link.inFlight = saved
+	dropSnapshot(rom)						# only partly written again
+	forgetWrites()
+
+
+#
+# === Name of the snapshot file for a ROM section
+#
+def snapshotFile(rom, directory=None):
+	return os.path.join(directory or snapshotDir, "CU%02d.bin" % rom)
+
+
+#
+# === Load the snapshot of the last image written to a ROM section
+#
+def loadSnapshot(rom, directory=None):
+	return loadImage(snapshotFile(rom, directory), layout.sectionSize)
+
+
+#
+# === Load an image of size bytes, None when there is none or it has
+#		another size
+#
+def loadImage(path, size):
+	try:
+		f = open(path, "rb")
+	except IOError:
+		return None
+	try:
+		image = bytearray(f.read())
+	finally:
+		f.close()
+	if len(image) != size:					# damaged snapshot, do not trust it
+		return None
+	return image
+
+
+#
+# === Forget the snapshot of a ROM section that was changed otherwise
+#
+def dropSnapshot(rom, directory=None):
+	try:
+		os.remove(snapshotFile(rom, directory))
+	except OSError:
+		pass
+
+
+#
+# === Forget the journals of unfinished writes and the snapshots of whole
+#		chips, after the chip was changed by CL, WR, FP or a write test,
+#		or read back with SN
+#
+def forgetWrites():
+	if not os.path.isdir(snapshotDir):
+		return
+	for name in os.listdir(snapshotDir):
+		if name.endswith(".journal"):
+			os.remove(os.path.join(snapshotDir, name))
+	dropChipSnapshots()
+
+
+#
+# === Forget the snapshots of whole chips, but the one of lane keep,
+#		after a ROM section or another chip was written or read
+#
+def dropChipSnapshots(keep=None):
+	if not os.path.isdir(snapshotDir):
+		return
+	for name in os.listdir(snapshotDir):
+		path = os.path.join(snapshotDir, name)
+		if name.endswith("_chip.bin") and (keep is None or path != chipSnapshotFile(keep)):
+			os.remove(path)
+
+
+#
+# === Save the image written to a ROM section as its snapshot
+#
+def saveSnapshot(rom, image, directory=None):
+	saveImage(snapshotFile(rom, directory), image)
+
+
+#
+# === Save an image, creating its directory when needed
+#
+def saveImage(path, image):
+	directory = os.path.dirname(path)
+	try:
+		os.makedirs(directory)
+	except OSError:
+		if not os.path.isdir(directory):
+			raise
+	f = open(path, "wb")
+	try:
+		f.write(image)
+	finally:
+		f.close()
+
+
+#
+# === Read the contents of a ROM section from the EEPROM with RB
+#
+def readSection(rom):
+	return link.readBlock(layout.address(rom, 0), layout.sectionSize)
+
+
+#
+# === Verify a ROM section against the image compiled from the microcode
+#
+#	Reads the section back in bulk and lists only the addresses that
+#	differ, the snapshot of the section is set to what was read
+#
+def verifyEEPROM(rom):
+	base = layout.address(rom, 0)
+	image = romImage(rom)
+	data = readSection(rom)
+	saveSnapshot(rom, data)
+	dropChipSnapshots()
+	if data == image:
+		print "# === ROM", rom, "verified, all %d bytes match" % len(data)
+		return True
+	print "# === ROM", rom, "differs:"
+	showMismatches(base, image, data)
+	return False
+
+
+#
+# === List the first addresses where data read differs from the image
+#
+def showMismatches(base, image, data):
+	mismatches = [i for i in range(0, len(image)) if data[i] != image[i]]
+	print "\t%d bytes differ" % len(mismatches)
+	for i in mismatches[:32]:
+		print "\t0x%04X  expected %02X  read %02X" % (base + i, image[i], data[i])
+	if len(mismatches) > 32:
+		print "\t... and %d more" % (len(mismatches) - 32)
+
+
+#
+# === Refresh the snapshots of all ROM sections from the EEPROM
+#
+def refreshSnapshots():
+	forgetWrites()
+	for rom in range(0, layout.chips):
+		print "# === Reading snapshot of ROM", rom, "from the EEPROM"
+		saveSnapshot(rom, readSection(rom))
+
+
+#
+# === The image of one EEPROM holding CU0, CU1 and CU2 in sections 0 - 2
+#		and the sections after them left erased
+#
+def chipImage():
+	image = bytearray().join(compiledImages()[1])
+	return image + bytearray([erasedValue]) * (layout.chipSize - len(image))
+
+
+#
+# === Write an image as raw binary
+#
+def writeBin(f, image, base=0):
+	f.write(image)
+
+
+#
+# === Write an image as Intel HEX, 16 data bytes per record, loaded at base
+#
+def writeIntelHex(f, image, base=0):
+	for offset in range(0, len(image), 16):
+		data = image[offset:offset + 16]
+		address = base + offset
+		record = bytearray([len(data), address >> 8, address & 0xFF, 0x00]) + data
+		f.write(":%s%02X\n" % (binascii.hexlify(record).upper(), -sum(record) & 0xFF))
+	f.write(":00000001FF\n")				# end of file record
+
+
+#
+# === Write an image as Motorola S-records, 16 data bytes per S1 record,
+#		loaded at base
+#
+def writeSRecord(f, image, base=0, name=""):
+	header = bytearray([len(name) + 3, 0x00, 0x00]) + bytearray(name)
+	f.write("S0%s%02X\n" % (binascii.hexlify(header).upper(), ~sum(header) & 0xFF))
+	for offset in range(0, len(image), 16):
+		data = image[offset:offset + 16]
+		address = base + offset
+		record = bytearray([len(data) + 3, address >> 8, address & 0xFF]) + data
+		f.write("S1%s%02X\n" % (binascii.hexlify(record).upper(), ~sum(record) & 0xFF))
+	f.write("S9030000FC\n")				# end of file record
+
+
+#
+# === Export the compiled images for use with a stand alone programmer
+#
+#	CU00, CU01 and CU02 hold one section each, CU_8K the whole EEPROM,
+#	named after its size in the layout, CU_16K with 16 steps.
+#	Every image is written as .bin, Intel .hex and S-record .s19; the
+#	.hex and .s19 files of a section load it at its address on the chip.
+#
+def exportImages(directory):
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	images = compiledImages()[1]
+	exports = [("CU%02d" % rom, images[rom], layout.address(rom, 0))
+		for rom in range(0, layout.chips)]
+	exports.append(("CU_%dK" % (layout.chipSize // 1024), chipImage(), 0))
+	for name, image, base in exports:
+		for extension, writer in ((".bin", writeBin), (".hex", writeIntelHex),
+				(".s19", writeSRecord)):
+			path = os.path.join(directory, name + extension)
+			f = open(path, "wb")
+			try:
+				if writer == writeSRecord:
+					writer(f, image, base, name)
+				else:
+					writer(f, image, base)
+			finally:
+				f.close()
+			print "# === Exported", path
+
+
+#
+# === Dump the contents of the EEPROM to a file
+#
+#	The range is read with RB in blocks of chunk bytes, each checked by
+#	its CRC and read again when damaged, and written to the file as it
+#	arrives. Files ending in .hex or .s19 get Intel HEX or S-records
+#	loading at address, written when all is read; others get the raw
+#	bytes. Returns what was read.
+#
+def dumpChip(path, address=0, length=None, chunk=1024):
+	length = length or layout.chipSize
+	extension = os.path.splitext(path)[1].lower()
+	f = open(path, "wb")
+	try:
+		data = bytearray()
+		begin = time.time()
+		for offset in range(0, length, chunk):
+			block = link.readBlock(address + offset, min(chunk, length - offset))
+			data += block
+			if extension not in (".hex", ".s19"):
+				f.write(block)
+			if sys.stdout.isatty():
+				showBar("dump", len(data), length, begin)
+		if sys.stdout.isatty():
+			print ""
+		if extension == ".hex":
+			writeIntelHex(f, data, address)
+		elif extension == ".s19":
+			writeSRecord(f, data, address, os.path.basename(path))
+	finally:
+		f.close()
+	elapsed = max(time.time() - begin, 1e-6)
+	print "# === %d bytes from 0x%04X dumped to %s, %.1f s, %.0f bytes/s" % (length,
+		address, path, elapsed, length / elapsed)
+	return data
+
+
+#
+# === Back up the whole chip before it is written for the first time,
+#		returns what was read
+#
+def backupChip():
+	if not os.path.isdir(backupDir):
+		os.makedirs(backupDir)
+	path = os.path.join(backupDir, "chip-%s.bin" % time.strftime("%Y%m%d-%H%M%S"))
+	print "# === No snapshots of this chip, backing it up first"
+	return dumpChip(path)
+
+
+#
+# === Program the chips in several Arduino programmers at the same time
+#
+#	assignments lists the port of each programmer with the ROM sections
+#	to write to the chip in it. Every port is driven by a thread of its
+#	own with its own snapshots, the progress shows one line per port.
+#
+def parallelFill(assignments, baud, diff=False, verify=False, options={}, rates=[]):
+	preflight()
+	compiledImages()						# compile once, not in every thread
+	status = dict((port, "waiting") for port, roms in assignments)
+	results = {}
+	threads = []
+	start = time.time()
+	for port, roms in assignments:
+		t = threading.Thread(target=flashPort,
+			args=(port, baud, roms, diff, verify, options, rates, status, results))
+		t.daemon = True
+		t.start()
+		threads.append(t)
+	shown = {}
+	while [th for th in threads if th.is_alive()]:
+		showProgress(assignments, status, shown)
+		time.sleep(0.2)
+	showProgress(assignments, status, shown)
+	elapsed = time.time() - start
+	print "# === Summary"
+	for port, roms in assignments:
+		ok, written, seconds, message = results[port]
+		print "# === %-24s %-12s %6d bytes %6.1f s  %s" % (port,
+			",".join(["CU%d" % rom for rom in roms]), written, seconds, message)
+	print "# === %d programmers, %d bytes in %.1f s" % (len(assignments),
+		sum(results[port][1] for port, roms in assignments), elapsed)
+	return not [port for port, roms in assignments if not results[port][0]]
+
+
+#
+# === Show one progress line per port, redrawn in place on a terminal
+#		and printed when changed otherwise
+#
+def showProgress(assignments, status, shown):
+	if sys.stdout.isatty():
+		if shown:
+			sys.stdout.write("\033[%dA" % len(assignments))
+		for port, roms in assignments:
+			sys.stdout.write("\033[K# === %-24s %s\n" % (port, status[port]))
+			shown[port] = status[port]
+	else:
+		for port, roms in assignments:
+			if shown.get(port) != status[port]:
+				print "# === %-24s %s" % (port, status[port])
+				shown[port] = status[port]
+	sys.stdout.flush()
+
+
+#
+# === Write ROM sections to the chip in the programmer on one port,
+#		run in a thread by parallelFill
+#
+#	Leaves (success, bytes written, seconds, message) in results
+#
+def flashPort(port, baud, roms, diff, verify, options, rates, status, results):
+	directory = os.path.join(snapshotDir, os.path.basename(port))
+	start = time.time()
+	written = 0
+	try:
+		status[port] = "connecting"
+		portLink = SerialLink(serial.Serial(port, baud), **options)
+		try:
+			portLink.waitForPrompt(timeout=10, echo=False)
+			if rates:
+				status[port] = "negotiating speed"
+				portLink.negotiate(rates, echo=False)
+			for rom in roms:
+				image = romImage(rom)
+				old = None
+				if diff:
+					old = loadSnapshot(rom, directory)
+					if old is None:
+						status[port] = "CU%d reading snapshot" % rom
+						old = portLink.readBlock(layout.address(rom, 0), layout.sectionSize)
+				commands, count, skipped = planWrite(rom, image, old)
+				status[port] = "CU%d writing %d commands" % (rom, len(commands))
+				def progress(done, total, rom=rom, count=count, begin=time.time()):
+					status[port] = "CU%d %3d%%  %6.0f bytes/s" % (rom, 100 * done // total,
+						count * done / total / max(time.time() - begin, 1e-6))
+				portLink.sendCommands(commands, echo=False, progress=progress)
+				saveSnapshot(rom, image, directory)
+				written += count
+				if verify:
+					status[port] = "CU%d verifying" % rom
+					data = portLink.readBlock(layout.address(rom, 0), layout.sectionSize)
+					saveSnapshot(rom, data, directory)
+					if data != image:
+						raise ProgrammerError("CU%d differs after programming" % rom)
+		finally:
+			try:
+				portLink.processCommand("QT !", echo=False)
+			except ProgrammerError:
+				pass
+			portLink.ser.close()
+	except Exception as e:					# a failure of this port only
+		status[port] = "ERROR - %s" % e
+		results[port] = (False, written, time.time() - start, "ERROR - %s" % e)
+		return
+	status[port] = "done"
+	results[port] = (True, written, time.time() - start, "complete")
+
+
+#
+# === Serial link to the Arduino programmer, opened by connect() for the
+#		first command that needs it
+#
+link = None
+
+
+#
+# === Port and speeds of the Arduino programmer, and the settings of the
+#		link, given to it when it is opened
+#
+portName = "/dev/cu.usbserial-AL02VGAJ"
+portBaud = 57600
+portRates = []
+linkOptions = {"timeout": 3.0, "retries": 3, "inFlight": 2, "echo": True, "echoRate": 0,
+	"trace": None}
+
+
+#
+# === Raised when the Arduino programmer does not respond as expected
+#
+class ProgrammerError(Exception):
+	pass
+
+
+#
+# === Raised in a background job that was cancelled, once the commands
+#		in flight have been answered
+#
+class JobCancelled(Exception):
+	pass
+
+
+#
+# === Serial link to the Arduino programmer
+#
+#	Pacing is driven by the protocol, not by fixed sleeps: the Arduino
+#	prints '>' when it is ready and a line holding '<' when it completed
+#	a command, so the next command goes out as soon as that line arrives.
+#	A command that gets no response line within timeout seconds has
+#	stalled, the link is resynchronised and the command is sent again,
+#	at most retries times.
+#
+#	Bulk commands are sent through a window: up to inFlight commands are
+#	on their way while the Arduino works on the first of them. Those
+#	waiting behind it sit in the Arduino's serial receive buffer, which
+#	holds rxBuffer bytes, so the window never queues more than that.
+#
+#	The time spent writing to the port, waiting for the Arduino and
+#	resynchronising after a stall is added up per phase in timing, with
+#	the bytes sent and received. When trace is set to an open file every
+#	write and every read is logged to it with its start and duration.
+#
+#	Reads take everything that has arrived at once into a buffer that is
+#	split into lines with string searches. Response lines are shown on
+#	the console only when echo is set, collected and written at most
+#	every echoInterval seconds; with echoRate set, no more than that
+#	many lines per second are shown and the rest are counted, the count
+#	reported at most once a second and at the end of a command.
+#
+#	Setting cancelled stops the link between commands: no new command
+#	is sent and JobCancelled is raised once the window is empty.
+#
+class SerialLink(object):
+
+	def __init__(self, ser, timeout=3.0, retries=3, inFlight=2, rxBuffer=63):
+		self.ser = ser
+		self.baud = ser.baudrate			# the speed the Arduino starts at
+		self.timeout = timeout
+		self.retries = retries
+		self.inFlight = inFlight
+		self.rxBuffer = rxBuffer			# 64 byte ring in the Arduino core
+		self.buffer = ""					# received, not yet read
+		self.position = 0					# start of what is not yet read
+		self.trace = None
+		self.echo = True
+		self.echoRate = 0					# lines shown per second, 0 all
+		self.echoInterval = 0.1
+		self.shown = []						# lines waiting to be shown
+		self.shownAt = 0.0
+		self.tokens = 0.0					# lines that may still be shown
+		self.tokensAt = 0.0
+		self.dropped = 0
+		self.droppedAt = 0.0
+		self.cancelled = False
+		self.resetTiming()
+
+
+	#
+	# === Start adding up the time per phase again
+	#
+	def resetTiming(self):
+		self.timing = {"write": 0.0, "wait": 0.0, "resync": 0.0}
+		self.bytesOut = 0
+		self.bytesIn = 0
+
+
+	#
+	# === Add the time since start to a phase and trace it
+	#
+	def account(self, phase, start, text=""):
+		end = time.time()
+		self.timing[phase] += end - start
+		if self.trace:
+			self.trace.write("%.6f\t%.6f\t%s\t%s\n" % (start, end - start, phase,
+				text.rstrip()))
+
+
+	#
+	# === Write data to the Arduino
+	#
+	def send(self, data, phase="write"):
+		start = time.time()
+		self.ser.write(data)
+		self.bytesOut += len(data)
+		self.account(phase, start, describe(data))
+
+
+	#
+	# === Add what has arrived to the buffer, waiting until deadline for
+	#		at least one byte, False when nothing came
+	#
+	def receive(self, deadline, phase="wait"):
+		remaining = deadline - time.time()
+		if remaining <= 0:
+			return False
+		self.ser.timeout = remaining
+		start = time.time()
+		received = self.ser.read(max(self.ser.in_waiting, 1))
+		self.bytesIn += len(received)
+		if received.translate(None, string.printable):
+			self.account(phase, start, "%d bytes" % len(received))
+		else:
+			self.account(phase, start, " | ".join(received.strip().splitlines()))
+		if not received:
+			return False
+		if self.position:
+			self.buffer = self.buffer[self.position:]
+			self.position = 0
+		self.buffer += received
+		return True
+
+
+	#
+	# === Read one response line, None when the Arduino stalled
+	#
+	#	A line received in part is kept and completed by the next read.
+	#
+	def readLine(self, timeout=None, phase="wait"):
+		deadline = time.time() + (timeout or self.timeout)
+		while True:
+			end = self.buffer.find("\n", self.position)
+			if end >= 0:
+				l = self.buffer[self.position:end + 1]
+				self.position = end + 1
+				return l
+			if not self.receive(deadline, phase):
+				return None
+
+
+	#
+	# === Read length raw bytes, fewer when they did not arrive in time
+	#
+	def readBytes(self, length, timeout, phase="wait"):
+		deadline = time.time() + timeout
+		while len(self.buffer) - self.position < length:
+			if not self.receive(deadline, phase):
+				break
+		data = self.buffer[self.position:self.position + length]
+		self.position += len(data)
+		return data
+
+
+	#
+	# === Forget everything received and not yet read
+	#
+	def discard(self):
+		self.buffer = ""
+		self.position = 0
+
+
+	#
+	# === Show a response line on the console, rate limited
+	#
+	#	With echoRate set every second adds echoRate lines that may be
+	#	shown, up to one second's worth; a line that finds none left is
+	#	counted instead.
+	#
+	def show(self, l):
+		if not self.echo:
+			return
+		now = time.time()
+		if self.echoRate:
+			self.tokens = min(self.tokens + (now - self.tokensAt) * self.echoRate,
+				self.echoRate)
+			self.tokensAt = now
+			if self.tokens < 1:
+				self.dropped += 1
+			else:
+				self.tokens -= 1
+				self.shown.append(l)
+		else:
+			self.shown.append(l)
+		if now - self.shownAt >= self.echoInterval:
+			self.flushEcho(final=False)
+
+
+	#
+	# === Write the lines waiting to be shown, with the count of the lines
+	#		not shown once a second and at the end of a command
+	#
+	def flushEcho(self, final=True):
+		now = time.time()
+		if self.dropped and (final or now - self.droppedAt >= 1.0):
+			self.shown.append("# === %d lines not shown\n" % self.dropped)
+			self.dropped = 0
+			self.droppedAt = now
+		if self.shown:
+			sys.stdout.write("".join(self.shown))
+			sys.stdout.flush()
+			self.shown = []
+		self.shownAt = now
+
+
+	#
+	# === Wait for Arduino programmer to be ready
+	#
+	def waitForPrompt(self, timeout=None, echo=True):
+		while True:
+			l = self.readLine(timeout)
+			if l is None:
+				raise ProgrammerError("No prompt from the Arduino programmer")
+			if echo:
+				self.show(l)
+			if '>' in l:
+				break
+		self.flushEcho()
+
+
+	#
+	# === Read and display responses until Arduino completed the action
+	#
+	def waitForEndAction(self, echo=True, timeout=None):
+		lines = []
+		while True:
+			l = self.readLine(timeout)
+			if l is None:
+				self.flushEcho()
+				return None
+			lines.append(l)
+			if echo:
+				self.show(l)
+			if '<' in l:
+				self.flushEcho()
+				return lines
+
+
+	#
+	# === Flush a partly received command out of the Arduino and drain
+	#		its responses until the link is quiet
+	#
+	def resync(self):
+		self.send("!", "resync")
+		while self.readLine(phase="resync") is not None:
+			pass
+
+
+	#
+	# === Stop here when the job using the link was cancelled
+	#
+	def checkCancelled(self):
+		if self.cancelled:
+			raise JobCancelled("cancelled")
+
+
+	#
+	# === Process a command given and wait for Arduino to be ready
+	#
+	def processCommand(self, command, echo=True, timeout=None):
+		self.checkCancelled()
+		for attempt in range(0, self.retries + 1):
+			self.send(command)
+			lines = self.waitForEndAction(echo, timeout)
+			if lines is not None:
+				return lines
+			print "# === No response to '%s', trying again" % command
+			self.resync()
+		raise ProgrammerError("No response from the Arduino to '%s'" % command)
+
+
+	#
+	# === Read a block of the EEPROM in bulk with RB and return its bytes
+	#
+	def readBlock(self, address, length):
+		self.checkCancelled()
+		for attempt in range(0, self.retries + 1):
+			self.send("RB %04X %04X !" % (address, length))
+			data = self.receiveBlock(length)
+			if data is not None:
+				return data
+			print "# === Bad response to the read of 0x%04X, trying again" % address
+			self.resync()
+		raise ProgrammerError("No proper response from the Arduino to the read of 0x%04X"
+			% address)
+
+
+	#
+	# === Receive the raw bytes answering RB, None when they did not all
+	#		arrive or their CRC does not match
+	#
+	def receiveBlock(self, length):
+		while True:
+			l = self.readLine()
+			if l is None or '<' in l:
+				return None
+			if l.startswith("RB "):
+				break
+		raw = bytearray(self.readBytes(length + 2,
+			self.timeout + 10.0 * length / self.ser.baudrate))
+		l = self.readLine()
+		if len(raw) != length + 2 or l is None or '<' not in l:
+			return None
+		data = raw[:length]
+		if binascii.crc_hqx(str(data), 0xFFFF) != (raw[length] << 8) | raw[length + 1]:
+			return None
+		return data
+
+
+	#
+	# === Close the port and open it again, trying for up to timeout
+	#		seconds, then wait for the prompt of the Arduino at baud
+	#
+	def reopen(self, baud, timeout):
+		deadline = time.time() + timeout
+		while True:
+			try:
+				self.ser.close()
+			except (serial.SerialException, EnvironmentError):
+				pass
+			time.sleep(0.5)					# let the Arduino see the port closed
+			try:
+				self.ser.baudrate = baud
+				self.ser.open()
+				self.discard()
+				self.waitForPrompt(timeout=10, echo=False)
+				print "# === Serial port %s open again" % self.ser.name
+				return
+			except (ProgrammerError, serial.SerialException, EnvironmentError) as e:
+				if time.time() > deadline:
+					raise ProgrammerError("Could not reconnect to %s: %s" % (self.ser.name, e))
+
+
+	#
+	# === Check the link with echo commands of random text, True when
+	#		every one comes back as sent
+	#
+	def echoTest(self, rounds=3):
+		for attempt in range(0, rounds):
+			text = binascii.hexlify(os.urandom(16)).upper()
+			self.send("EC %s !" % text)
+			lines = self.waitForEndAction(echo=False, timeout=1.0)
+			if lines is None or "".join(lines).find("EC %s " % text) < 0:
+				return False
+		return True
+
+
+	#
+	# === Switch the link to the fastest of rates that passes the echo test
+	#		and return the speed in use
+	#
+	#	SP makes the Arduino change speed, SK at the new speed makes it
+	#	keep it. Without SK the Arduino falls back to the speed it started
+	#	at after speedTimeout, which is waited for when a speed fails.
+	#	Firmware without SP answers with an error and keeps its speed.
+	#
+	def negotiate(self, rates, echo=True):
+		base = self.ser.baudrate
+		for rate in sorted(rates, reverse=True):
+			if rate <= base:
+				continue
+			lines = self.processCommand("SP %d !" % rate, echo=False)
+			if "".join(lines).find("SP %d <" % rate) < 0:
+				if echo:
+					print "# === The Arduino does not change speed, staying at %d baud" % base
+				return base
+			switched = time.time()
+			try:
+				self.ser.baudrate = rate
+				if self.echoTest():
+					lines = self.processCommand("SK !", echo=False)
+					if "".join(lines).find("SK <") >= 0:
+						if echo:
+							print "# === Serial link switched to %d baud" % rate
+						return rate
+			except (ProgrammerError, serial.SerialException, ValueError, IOError):
+				pass
+			if echo:
+				print "# === %d baud is not stable, falling back" % rate
+			self.ser.baudrate = base
+			time.sleep(max(switched + speedTimeout + 0.2 - time.time(), 0))
+			self.ser.flushInput()
+			self.discard()
+			if not self.echoTest():
+				raise ProgrammerError("The Arduino did not fall back to %d baud" % base)
+		if echo:
+			print "# === Serial link stays at %d baud" % base
+		return base
+
+
+	#
+	# === Check whether a command fits in the window behind the pending ones
+	#
+	def fits(self, pending, command):
+		if not pending:
+			return True
+		queued = sum(len(c) for c, lines in pending[1:])
+		return len(pending) < self.inFlight and queued + len(command) <= self.rxBuffer
+
+
+	#
+	# === Process a series of commands through the window and return the
+	#		time it took
+	#
+	#	Completions arrive in the order the commands were sent, so each '<'
+	#	acknowledges the oldest pending command, progress is called with
+	#	the number of commands completed after each of them. Its response must hold the
+	#	echo the Arduino gives of that command. A stalled link, an ERROR or
+	#	a response that does not match gets the pending commands sent again.
+	#
+	def sendCommands(self, commands, echo=True, progress=None):
+		start = time.time()
+		pending = []						# [command, response] sent, not completed
+		tries = 0
+		sent = 0
+		while sent < len(commands) or pending:
+			if self.cancelled and not pending:
+				raise JobCancelled("cancelled after %d of %d commands" % (sent, len(commands)))
+			while (sent < len(commands) and not self.cancelled
+					and self.fits(pending, commands[sent])):
+				self.send(commands[sent])
+				pending.append([commands[sent], []])
+				sent += 1
+			l = self.readLine()
+			if l is not None:
+				if echo:
+					self.show(l)
+				pending[0][1].append(l)
+				if '<' not in l:
+					continue
+				if acknowledges(pending[0][0], pending[0][1]):
+					pending.pop(0)
+					tries = 0
+					if progress:
+						progress(sent - len(pending), len(commands))
+					continue
+			tries += 1
+			if tries > self.retries:
+				raise ProgrammerError("No proper response from the Arduino to '%s'"
+					% describe(pending[0][0]))
+			self.flushEcho()
+			print "# === No proper response to '%s', trying again" % describe(pending[0][0])
+			self.resync()
+			for entry in pending:
+				entry[1] = []
+				self.send(entry[0])
+		self.flushEcho()
+		return time.time() - start
 
 
 #
-# === Process a command given and wait for Arduino to be ready
+# === Printable form of a command, binary frames only show their header
 #
-def  processCommand(command):
-	ser.write(command)
-	waitForEndAction()
+def describe(command):
+	if command[:2] == "WB":
+		header = bytearray(command[2:5])
+		return "WB %04X, %d bytes" % ((header[0] << 8) | header[1], header[2])
+	return command
+
+
+#
+# === Check that the response to a command acknowledges that command
+#
+#	WR is answered with an echo of its address and values, WB and FP with
+#	their address and length, other commands only need to complete
+#	without an error
+#
+def acknowledges(command, response):
+	if "".join(response).find("ERROR") >= 0:
+		return False
+	if command[:2] == "WR":
+		echo = command[3:].rstrip("! ").lower()
+	elif command[:2] == "WB":
+		header = bytearray(command[2:5])
+		echo = "WB %04x %02x" % ((header[0] << 8) | header[1], header[2])
+	elif command[:2] == "FP":
+		echo = "FP " + command[3:12].lower()
+	else:
+		return True
+	for l in response:
+		if echo in l:						# debug firmware prefixes "Writing "
+			return True
+	return False
 
 
 #
@@ -477,25 +1617,133 @@ def showInstructions(ID, LL):
 	else:
 		print "Showing control words for instructions 0x%02X - 0x%02X" % (ID, ID+LL-1)
 	print " "
-	for op, contr in sorted(instr.iteritems()):	# iterate through instruction table
-		if ((op >= ID) and (op <= (ID + LL -1))):
-			print "0x%02X" % op
-			buffer = "   "
-			buf0 = "      CU0 -  "
-			buf1 = "      CU1 -  "
-			buf2 = "      CU2 -  "
-			for i in range(0, len(contr)):		# iterate through microcode steps and
-												# 	print the 3 byte control words
-				toadd = "%06X " % contr[i]
-				buffer = buffer + toadd
-				buf0 = buf0 + str("%02X " % ((contr[i]) & 0xFF) )
-				buf1 = buf1 + str("%02X " % ((contr[i] >> 8) & 0xFF) )
-				buf2 = buf2 + str("%02X " % ((contr[i] >> 16) & 0xFF) )
-			print buffer
-			print buf0
-			print buf1
-			print buf2
-			print " "
+	words, images = compiledImages()
+	hazards = gaw_hazards.byOpcode(microcodeHazards(microcode))
+	steps = layout.steps
+	digits = 2 * layout.chips
+	for op in range(ID, min(ID + LL, 1 << layout.opcodeBits)):	# iterate through instructions
+		a = op * steps						# print the control words
+		print "0x%02X  %s" % (op, microcode.names[op])
+		print "   " + "".join(["%0*X " % (digits, w) for w in words[a:a + steps]])
+		for rom in range(0, layout.chips):
+			print "      CU%d -  " % rom + "".join(["%02X " % v for v in images[rom][a:a + steps]])
+		for text in hazards.get(op, []):
+			print "      !!     " + text
+		print " "
+
+
+#
+# === Show or change a setting of the serial link, Syntax: SET NAME VALUE
+#
+def setOption(args):
+	global writeMode, fillRuns, autoBackup, reconnectTimeout, verifyResume, variantFiles
+	global checkHazards
+	fields = args.split()
+	if len(fields) == 2:
+		fields[0] = fields[0].upper()
+		if fields[0] not in ("TRACE", "VARIANTS"):	# file names keep their case
+			fields[1] = fields[1].upper()
+		try:
+			if fields[0] == "MODE":
+				if fields[1] in ("WR", "WB"):
+					writeMode = fields[1]
+				else:
+					print "MODE must be WR or WB"
+			elif fields[0] == "FILL":
+				if fields[1] in ("ON", "OFF"):
+					fillRuns = fields[1] == "ON"
+				else:
+					print "FILL must be ON or OFF"
+			elif fields[0] == "BACKUP":
+				if fields[1] in ("ON", "OFF"):
+					autoBackup = fields[1] == "ON"
+				else:
+					print "BACKUP must be ON or OFF"
+			elif fields[0] == "CHECK":
+				if fields[1] in ("ON", "OFF"):
+					checkHazards = fields[1] == "ON"
+				else:
+					print "CHECK must be ON or OFF"
+			elif fields[0] == "TRACE":
+				setTrace(fields[1])
+			elif fields[0] == "TIMEOUT":
+				setLinkOption("timeout", float(fields[1]))
+			elif fields[0] == "RETRIES":
+				setLinkOption("retries", int(fields[1]))
+			elif fields[0] == "INFLIGHT":
+				setLinkOption("inFlight", max(int(fields[1]), 1))
+			elif fields[0] == "VARIANTS":
+				if len(fields[1].split(",")) <= layout.sections:
+					variantFiles = fields[1].split(",")
+				else:
+					print "VARIANTS takes at most %d files" % layout.sections
+			elif fields[0] == "REOPEN":
+				reconnectTimeout = max(float(fields[1]), 0.0)
+			elif fields[0] == "REVERIFY":
+				if fields[1] in ("ON", "OFF"):
+					verifyResume = fields[1] == "ON"
+				else:
+					print "REVERIFY must be ON or OFF"
+			elif fields[0] == "ECHO":
+				if fields[1] in ("ON", "OFF"):
+					setLinkOption("echo", fields[1] == "ON")
+					setLinkOption("echoRate", 0)
+				else:
+					setLinkOption("echoRate", max(int(fields[1]), 1))
+					setLinkOption("echo", True)
+			else:
+				print "Unknown setting", fields[0]
+		except ValueError:
+			print "Invalid value", fields[1], "for", fields[0]
+	elif len(fields) != 0:
+		print "Syntax: SET NAME VALUE"
+	print "\tMODE     %s\twrite blocks as WR text or as WB binary frames" % writeMode
+	print "\tFILL     %s\twrite runs of identical blocks with one FP command" % (
+		fillRuns and "ON" or "OFF")
+	print "\tBACKUP   %s\tdump a chip without snapshots to %s before writing it" % (
+		autoBackup and "ON" or "OFF", backupDir)
+	print "\tCHECK    %s\trefuse to program microcode with hazards" % (
+		checkHazards and "ON" or "OFF")
+	print "\tTIMEOUT  %.1f\tseconds without response before a command stalls" % (
+		linkOptions["timeout"])
+	print "\tRETRIES  %d\ttimes a stalled command is sent again" % linkOptions["retries"]
+	print "\tINFLIGHT %d\tcommands in the window, as far as the Arduino buffer allows" % (
+		linkOptions["inFlight"])
+	print "\tVARIANTS %s\tmicrocode sources for the sections of WC" % (
+		",".join(variantSources()))
+	print "\tREOPEN   %.0f\tseconds a write that lost the link tries to reopen the port" % (
+		reconnectTimeout)
+	print "\tREVERIFY %s\tread back the block in flight before resuming a write" % (
+		verifyResume and "ON" or "OFF")
+	print "\tECHO     %s\tresponse lines shown per second, ON all or OFF" % (
+		not linkOptions["echo"] and "OFF" or linkOptions["echoRate"] or "ON")
+	print "\tTRACE    %s\tfile logging every serial write and read, or OFF" % (
+		linkOptions["trace"] and linkOptions["trace"].name or "OFF")
+
+
+#
+# === Change a setting of the serial link, now and for a link opened later
+#
+def setLinkOption(name, value):
+	linkOptions[name] = value
+	if link:
+		setattr(link, name, value)
+
+
+#
+# === Log every serial write and read to a file, or stop doing so with OFF
+#
+#	Each line holds the start time, the duration in seconds, the phase
+#	and the command sent or the response received, separated by tabs.
+#
+def setTrace(path):
+	if linkOptions["trace"]:
+		linkOptions["trace"].close()
+		setLinkOption("trace", None)
+	if path.upper() != "OFF":
+		trace = open(path, "a")
+		trace.write("# start\tseconds\tphase\tdata\n")
+		setLinkOption("trace", trace)
 
 
 #
@@ -515,15 +1763,68 @@ def displayHelp():
 	print "\tRD\tRead from the EEPROM,\tSyntax:RD AAAA LLLL"
 	print ""
 	print "\tSH\tShow control word for instruction(s),\tSyntax:SH II LL"
-	print "\t\t   including EEPROM contents per chip"
+	print "\t\t   including EEPROM contents per chip and hazards"
+	print "\tCK\tCheck the microcode for hazards,\tSyntax:CK"
+	print "\t\t   bus conflicts, rows without RSC or HLT, steps after"
+	print "\t\t   RSC and rows without the fetch; every write checks first"
 	print ""
 	print "\tWR\tWrite to the EEPROM,\tSyntax: WR AAAA VV VV VV VV VV VV VV VV"
+	print "\tFP\tFill with a pattern,\tSyntax: FP AAAA LLLL VV VV VV VV VV VV VV VV"
+	print "\t\t   repeats the 8 values over LLLL bytes from AAAA"
 	print ""
 	print "\tW0\tWrite CU0 to the EEPROM"
 	print "\tW1\tWrite CU1 to the EEPROM"
 	print "\tW2\tWrite CU2 to the EEPROM"
 	print "\tFL\tFill the EEPROM with CU0, CU1 and CU2 values"
 	print ""
+	print "\tD0\tWrite only the changed blocks of CU0 to the EEPROM"
+	print "\tD1\tWrite only the changed blocks of CU1 to the EEPROM"
+	print "\tD2\tWrite only the changed blocks of CU2 to the EEPROM"
+	print "\tDF\tFill the EEPROM with only the changed blocks of CU0, CU1 and CU2"
+	print "\tCF\tClear the EEPROM, then fill it skipping the erased blocks"
+	print "\tVF\tVerify CU0, CU1 and CU2 against the EEPROM,\tSyntax: VF or VF R"
+	print "\t\t   reads the sections back in bulk, lists differences only"
+	print ""
+	print "\tWC\tWrite the microcode variants for byte N,\tSyntax: WC N"
+	print "\t\t   into EEPROM CU0N, one variant per 2K section, in"
+	print "\t\t   one pass skipping unchanged blocks, then verify it"
+	print "\tVC\tVerify EEPROM CU0N against the variants,\tSyntax: VC N"
+	print ""
+	print "\tDU\tDump the EEPROM to a file,\tSyntax: DU FILE or DU AAAA LLLL FILE"
+	print "\t\t   the whole chip or LLLL bytes from AAAA, as Intel HEX"
+	print "\t\t   for .hex, S-records for .s19 and raw bytes otherwise"
+	print ""
+	print "\tEX\tExport CU0, CU1, CU2 and the whole EEPROM image,\tSyntax: EX DIR"
+	print "\t\t   as .bin, Intel .hex and S-record .s19 files, into"
+	print "\t\t   directory DIR or 'export'"
+	print ""
+	print "\tSN\tRead the snapshots of CU0, CU1 and CU2 back from the EEPROM"
+	print "\t\t   the D commands compare against these snapshots, which"
+	print "\t\t   are kept of the last image written to each section"
+	print ""
+	print "\tSET\tShow or change a setting,\tSyntax: SET NAME VALUE"
+	print "\t\t   MODE selects WR or the binary WB block write,"
+	print "\t\t   FILL ON or OFF the FP command for runs of equal blocks,"
+	print "\t\t   BACKUP ON or OFF the backup of a chip without snapshots,"
+	print "\t\t   CHECK ON or OFF refusing microcode with hazards,"
+	print "\t\t   TIMEOUT, RETRIES and INFLIGHT pace the serial link,"
+	print "\t\t   VARIANTS FILE,... microcode sources for sections 0 - 3,"
+	print "\t\t   REOPEN seconds a write retries a lost link, 0 never,"
+	print "\t\t   REVERIFY ON or OFF reading back the block in flight,"
+	print "\t\t   ECHO ON, OFF or N shows all, none or N lines per second"
+	print "\t\t   of the Arduino's responses,"
+	print "\t\t   TRACE FILE logs every serial write and read, TRACE OFF stops it"
+	print ""
+	print "\tWT\tMeasure write speed per window size,\tSyntax: WT R"
+	print "\t\t   rewrites the first 32 blocks of CU0, CU1 or CU2"
+	print ""
+	print "\tJOBS\tList the background jobs with their progress"
+	print "\tWAIT\tWait for a job and show its output,\tSyntax: WAIT or WAIT N"
+	print "\t\t   without N every job not yet shown"
+	print "\tCANCEL\tCancel a job,\tSyntax: CANCEL or CANCEL N"
+	print "\t\t   W0 - W2, D0 - D2, FL, DF, CF, VF, WC, VC, SN and DU run"
+	print "\t\t   as jobs in the background, one at a time"
+	print ""
 	print "\tQ\tQuit the program"
 	print ""
 	print "All parameters are position dependent, they must be in"
@@ -540,76 +1841,725 @@ def displayHelp():
 	
 
 
+#
+# === The CU number given as the operand of a command, None when it is
+#		not a number or not one of the layout
+#
+def romOperand(text):
+	try:
+		rom = int(text)
+	except ValueError:
+		return None
+	if rom not in range(0, layout.chips):
+		return None
+	return rom
+
+
 # ------------------------------------------------------------------------
 #												Start of executable code
 # ------------------------------------------------------------------------
 
 #
-# === Establish serial interface
+# === Execute one command, as typed at the prompt or read from a script
+#
+#	Returns False when the command failed
 #
-print "# === Program gaw_eeprom_programmer starts"
+def executeCommand(Line):
+	Command = Line.strip().upper()
+	try:
+		if needsArduino(Command):
+			active = [job for job in jobs if job.active()]
+			if active and threading.current_thread() is not jobWorker:
+				print "Job %d is using the Arduino, WAIT for it or CANCEL it first" % (
+					active[0].number)
+				return False
+			connect()
+		
+		if (Command == "" or Command[:1] == "#"):
+			pass
+			
+		elif (Command == "?" or Command == "H" or Command == "HELP"):
+			displayHelp()
+			
+		elif (len(Command) == 2 and Command[0] in "WD" and Command[1].isdigit()
+				and int(Command[1]) < layout.chips):
+			writeEEPROM(int(Command[1]), diff=Command[0] == "D")	# W0 - W2, D0 - D2
+			print "Programming complete"
+			
+		elif (Command == "FL"):
+			for rom in range(0, layout.chips):
+				writeEEPROM(rom)
+			print "Programming complete"
+			
+		elif (Command == "DF"):
+			for rom in range(0, layout.chips):
+				writeEEPROM(rom, diff=True)
+			print "Programming complete"
+			
+		elif (Command[:2] == "VF"):
+			roms = range(0, layout.chips)
+			if len(Command) > 2:
+				roms = [romOperand(Command[2:])]
+				if roms[0] is None:
+					print "Syntax: VF or VF R, R the section 0 - %d" % (layout.chips - 1)
+					return False
+			verified = True
+			for rom in roms:
+				verified = verifyEEPROM(rom) and verified
+			if verified:
+				print "Verification complete"
+			else:
+				print "Verification FAILED"
+				return False
+			
+		elif (Command[:2] in ("WC", "VC")):
+			lane = romOperand(Command[2:])
+			if lane is None:
+				print "Syntax: %s N, N the EEPROM 0 - %d" % (Command[:2], layout.chips - 1)
+				return False
+			if Command[:2] == "WC":
+				verified = writeChip(lane)
+			else:
+				verified = verifyChip(lane)
+			if not verified:
+				print "Verification FAILED"
+				return False
+			print "Verification complete"
+			
+		elif (Command[:2] == "DU"):
+			fields = Line.strip()[3:].split()
+			if len(fields) == 3:
+				dumpChip(fields[2], int(fields[0], 16), int(fields[1], 16))
+			elif len(fields) == 1:
+				dumpChip(fields[0])
+			else:
+				print "Syntax: DU FILE or DU AAAA LLLL FILE"
+				return False
+			
+		elif (Command[:2] == "EX"):
+			exportImages(Line.strip()[3:].strip() or "export")
+			
+		elif (Command == "SN"):
+			refreshSnapshots()
+			
+		elif (Command == "JOBS"):
+			showJobs()
+			
+		elif (Command[:4] == "WAIT"):
+			return waitJobs(Command[4:])
+			
+		elif (Command[:6] == "CANCEL"):
+			cancelJob(Command[6:])
+			
+		elif (Command == "CK"):
+			if not checkMicrocode(variantFiles or None):
+				return False
+			
+		elif (Command == "CF"):				# D skips the erased blocks
+			preflight()						# before the chip is cleared
+			if not (executeCommand("CL") and executeCommand("DF")):
+				return False
+			
+		elif (Command == "CL"):
+			link.processCommand(Command + " !", timeout=30)
+			forgetWrites()
+			for rom in range(0, layout.chips):	# the EEPROM is all erased now
+				saveSnapshot(rom, bytearray([erasedValue]) * layout.sectionSize)
+			
+		elif (Command[:2] == "WT"):
+			rom = romOperand(Command[2:])
+			if rom is None:
+				print "Syntax: WT R, R the section 0 - %d" % (layout.chips - 1)
+				return False
+			windowTest(rom)
+			
+		elif (Command[:3] == "SET"):
+			setOption(Line.strip()[3:])
+			
+		elif (Command[:2] == "SH"):
+			ic = Command[3:5]
+			id = int(ic, 16)
+			ll = 1
+			if len(Command) > 5:
+				ll = int(Command[6:8],16)
+			showInstructions(id, ll)
+			
+		else:
+			if (Command[:2] in ("WR", "FP")):	# snapshot no longer matches
+				forgetWrites()
+				try:
+					dropSnapshot(int(Command[3:7], 16) // layout.sectionSize)
+				except ValueError:
+					pass
+			for l in link.processCommand(Command + " !"):
+				if l.find("ERROR") >= 0:
+					return False
+			
+	except (ProgrammerError, gaw_microcode.MicrocodeError, gaw_layout.LayoutError,
+			EnvironmentError) as e:
+		print "ERROR -", e
+		return False
+	except ValueError:
+		print "ERROR - Invalid operand in", Command
+		return False
+	return True
 
-ser = serial.Serial("/dev/cu.usbserial-AL02VGAJ", 57600)
-print "# === using port", ser.name
 
-waitForPrompt()
+#
+# === Open the serial interface and wait for the Arduino programmer
+#
+def openLink(port, baud, rates=[]):
+	global link
+	opened = SerialLink(serial.Serial(port, baud))
+	for name, value in linkOptions.items():
+		setattr(opened, name, value)
+	print "# === using port", opened.ser.name
+	try:
+		opened.waitForPrompt(timeout=10)		# Arduino resets when port opens
+		if rates:
+			opened.negotiate(rates)
+	except ProgrammerError:
+		opened.ser.close()
+		raise
+	link = opened
 
-print ""
-print "Enter '?' for more information"
-print ""
 
 #
-# === Read and execute commands
+# === The link to the Arduino programmer, opened when it is not yet
 #
-while True:
-	Command = raw_input("$ gaw_eeprom_programmer > ").upper()
-	
-	if (Command == "Q"):
-		break
-		
-	elif (Command == "?" or Command == "H" or Command == "HELP"):
-		displayHelp()
-		
-	elif (Command == "W0"):
-		writeEEPROM(0)
-		print "Programming complete"
-		
-	elif (Command == "W1"):
-		writeEEPROM(1)
-		print "Programming complete"
-		
-	elif (Command == "W2"):
-		writeEEPROM(2)
-		print "Programming complete"
-		
-	elif (Command == "FL"):
-		writeEEPROM(0)
-		writeEEPROM(1)
-		writeEEPROM(2)
-		print "Programming complete"
-		
-	elif (Command[:2] == "SH"):
-		ic = Command[3:5]
-		id = int(ic, 16)
-		ll = 1
-		if len(Command) > 5:
-			ll = int(Command[6:8],16)
-		showInstructions(id, ll)
-		
+def connect():
+	if link is None:
+		openLink(portName, portBaud, portRates)
+		if console and console.job and console.job.cancelled:
+			link.cancelled = True			# cancelled while connecting
+	return link
+
+
+#
+# === Open the serial port again after the link failed, and bring the
+#		Arduino, which resets when it opens, back to the speed in use
+#
+def reconnectLink():
+	speed = link.ser.baudrate
+	link.reopen(link.baud, reconnectTimeout)
+	if speed != link.baud:
+		link.negotiate([speed], echo=False)
+
+
+#
+# === Stop the Arduino and close the serial interface
+#
+def closeLink():
+	global link
+	if link:
+		try:
+			link.processCommand("QT !")
+		except ProgrammerError as e:
+			print "ERROR -", e
+	if linkOptions["trace"]:
+		linkOptions["trace"].close()
+	if link:
+		print "# === Closing serial port"
+		link.ser.close()
+		link = None
+
+
+#
+# === Background jobs
+#
+#	At the prompt the commands that write or verify whole sections or
+#	chips are queued as jobs, run one after the other by a worker
+#	thread, so SH, CK, SET and the like can be used meanwhile. What a
+#	job prints is kept with the job instead of shown: JOBS lists the
+#	jobs with the last line each printed, WAIT shows all of it once the
+#	job is done and CANCEL stops a job after the commands in flight.
+#	Other commands for the Arduino are refused while a job has the link.
+#
+jobs = []
+jobQueue = Queue.Queue()
+jobWorker = None
+console = None
+
+
+#
+# === Commands run as a job at the prompt
+#
+def inBackground(Command):
+	return (Command in ("FL", "DF", "CF", "SN") or Command[:2] in ("VF", "WC", "VC", "DU")
+		or (len(Command) == 2 and Command[0] in "WD" and Command[1].isdigit()))
+
+
+#
+# === Commands that need the Arduino programmer
+#
+def needsArduino(Command):
+	if Command in ("", "?", "H", "HELP", "CK", "JOBS") or Command[:1] == "#":
+		return False
+	return Command[:2] not in ("SH", "EX") and Command.split()[0] not in ("SET", "WAIT",
+		"CANCEL")
+
+
+#
+# === A command run in the background, with what it printed
+#
+class Job(object):
+
+	def __init__(self, number, command):
+		self.number = number
+		self.command = command
+		self.state = "queued"
+		self.output = []
+		self.started = None
+		self.ended = None
+		self.cancelled = False
+		self.reported = False				# its output was shown
+		self.announced = False				# its end was shown
+		self.finished = threading.Event()
+
+
+	def active(self):
+		return self.state in ("queued", "running")
+
+
+	#
+	# === Keep what the job prints
+	#
+	def write(self, text):
+		self.output.append(text)
+
+
+	#
+	# === The lines the job printed, a progress bar redrawn in place by
+	#		its last state
+	#
+	def lines(self):
+		text = "".join(self.output).rstrip("\n")
+		return [l.rstrip("\r").split("\r")[-1] for l in text.split("\n") if text]
+
+
+	def summary(self):
+		elapsed = 0.0
+		if self.started:
+			elapsed = (self.ended or time.time()) - self.started
+		return "[%d] %-9s %6.1f s  %s" % (self.number, self.state, elapsed, self.command)
+
+
+#
+# === Console passing what the worker thread prints to the job it runs
+#
+class Console(object):
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.job = None
+
+
+	def write(self, text):
+		if self.job and threading.current_thread() is jobWorker:
+			self.job.write(text)
+		else:
+			self.stream.write(text)
+
+
+	def __getattr__(self, name):
+		return getattr(self.stream, name)
+
+
+#
+# === Queue a command as a job, the worker is started when needed
+#
+def startJob(Line):
+	global jobWorker
+	job = Job(len(jobs) + 1, Line.strip())
+	jobs.append(job)
+	jobQueue.put(job)
+	if jobWorker is None or not jobWorker.is_alive():
+		jobWorker = threading.Thread(target=runJobs)
+		jobWorker.daemon = True
+		jobWorker.start()
+	print "[%d] %s" % (job.number, job.command)
+
+
+#
+# === Run the queued jobs one after the other, in the worker thread
+#
+def runJobs():
+	while True:
+		job = jobQueue.get()
+		if job.cancelled:
+			continue
+		job.state = "running"
+		job.started = time.time()
+		console.job = job
+		try:
+			ok = executeCommand(job.command)
+			job.state = ok and "done" or "failed"
+		except JobCancelled as e:
+			print "# === Job %d %s" % (job.number, e)
+			job.state = "cancelled"
+		finally:
+			if job.state == "running":
+				job.state = "failed"
+			console.job = None
+			if link:
+				link.cancelled = False
+			job.ended = time.time()
+			job.finished.set()
+
+
+#
+# === The job numbered by text, or the last one still active
+#
+def findJob(text):
+	if text.strip():
+		number = int(text)
+		if number < 1 or number > len(jobs):
+			raise ProgrammerError("No job %d" % number)
+		return jobs[number - 1]
+	active = [job for job in jobs if job.active()]
+	if not active:
+		raise ProgrammerError("No job running")
+	return active[-1]
+
+
+#
+# === List the jobs, with the last line each printed
+#
+def showJobs():
+	if not jobs:
+		print "No jobs"
+	for job in jobs:
+		lines = job.lines()
+		print job.summary() + (lines and "  " + lines[-1] or "")
+
+
+#
+# === Wait for jobs to end and show what they printed, the job numbered
+#		by text or every job not yet shown; returns False when one of
+#		them did not complete
+#
+def waitJobs(text):
+	if text.strip():
+		waiting = [findJob(text)]
 	else:
-		processCommand(Command + " !")
+		waiting = [job for job in jobs if job.active() or not job.reported]
+	ok = True
+	for job in waiting:
+		try:
+			while not job.finished.wait(0.2):	# a timeout keeps Ctrl-C working
+				pass
+		except KeyboardInterrupt:
+			print ""
+			print "# === Stopped waiting, job %d carries on" % job.number
+			return False
+		for l in job.lines():
+			print l
+		print job.summary()
+		job.reported = job.announced = True
+		ok = ok and job.state == "done"
+	return ok
+
+
+#
+# === Cancel a queued job, or stop the running one after the commands in
+#		flight; a write can be continued later from its journal
+#
+def cancelJob(text):
+	job = findJob(text)
+	if not job.active():
+		print "Job %d has ended" % job.number
+		return
+	job.cancelled = True
+	if job.state == "queued":
+		job.state = "cancelled"
+		job.finished.set()
+	elif link:
+		link.cancelled = True
+	print "[%d] cancelling %s" % (job.number, job.command)
+
 
 #
-# === Stop the Arduino
+# === Show the jobs that ended since the last prompt
 #
-processCommand("QT !")
+def announceJobs():
+	for job in jobs:
+		if not job.active() and not job.announced:
+			print "%s, WAIT %d shows its output" % (job.summary(), job.number)
+			job.announced = True
 
-print "# === Closing serial port"
-ser.close()
 
-print "# === End program"
+#
+# === Read and execute commands typed at the prompt
+#
+#	The link is opened by the first command that needs the Arduino, so
+#	showing and exporting the microcode can start at once. Long commands
+#	run as jobs; at the end of the input the jobs are waited for, Q is
+#	refused while they run.
+#
+def interactive():
+	global console
+	print ""
+	print "Enter '?' for more information"
+	print ""
+	console = Console(sys.stdout)
+	sys.stdout = console
+	try:
+		while True:
+			announceJobs()
+			try:
+				Line = raw_input("$ gaw_eeprom_programmer > ")
+			except EOFError:
+				waitJobs("")
+				break
+			Command = Line.strip().upper()
+			if (Command == "Q"):
+				active = [job for job in jobs if job.active()]
+				if not active:
+					break
+				print "Job %d is still running, WAIT for it or CANCEL it first" % (
+					active[0].number)
+			elif inBackground(Command):
+				startJob(Line)
+			else:
+				executeCommand(Line)
+	finally:
+		sys.stdout = console.stream
+	return True
+
+
+#
+# === Execute the commands in a script file, one per line, stopping at
+#		the first command that fails
+#
+def runScript(path):
+	f = open(path)
+	try:
+		for number, Line in enumerate(f, 1):
+			if (Line.strip().upper() == "Q"):
+				break
+			print "$ %s:%d > %s" % (path, number, Line.strip())
+			if not executeCommand(Line):
+				print "# === Script %s stopped at line %d" % (path, number)
+				return False
+	finally:
+		f.close()
+	return True
+
+
+#
+# === Commands for the actions given on the command line
+#
+def actionCommands(args):
+	roms = range(0, layout.chips)
+	if args.rom:
+		roms = [int(r) for r in args.rom.split(",")]
+	if [rom for rom in roms if rom not in range(0, layout.chips)]:
+		raise ValueError("--rom takes CU numbers 0 - %d" % (layout.chips - 1))
+	commands = []
+	if args.action == "fill":
+		if args.clear:						# D skips the erased blocks
+			commands.append("CL")
+		if args.diff or args.clear:
+			commands += ["D%d" % rom for rom in roms]
+		else:
+			commands += ["W%d" % rom for rom in roms]
+	if args.action == "verify" or args.verify:
+		commands += ["VF %d" % rom for rom in roms]
+	if args.action == "clear":
+		commands.append("CL")
+	if args.action == "read":
+		address, length = args.operands
+		commands.append("RD %04X %04X" % (int(address, 16), int(length, 16)))
+	if args.action == "chip":
+		commands.append("WC %s" % args.operands[0])
+	if args.action == "dump":
+		if len(args.operands) == 3:
+			commands.append("DU %04X %04X %s" % (int(args.operands[1], 16),
+				int(args.operands[2], 16), args.operands[0]))
+		else:
+			commands.append("DU " + args.operands[0])
+	return commands
+
+
+#
+# === Ports with the ROM sections assigned to them, from PORT=0,1 operands,
+#		a port without sections gets the whole chip
+#
+def portAssignments(operands):
+	assignments = []
+	for operand in operands:
+		port, sep, given = operand.partition("=")
+		roms = range(0, layout.chips)
+		if given:
+			roms = [int(r) for r in given.split(",")]
+		if [rom for rom in roms if rom not in range(0, layout.chips)]:
+			raise ValueError("sections for %s must be CU numbers 0 - %d" % (port,
+				layout.chips - 1))
+		assignments.append((port, roms))
+	return assignments
+
+
+#
+# === Command line interface
+#
+def parseArguments(argv):
+	parser = argparse.ArgumentParser(prog="gaw_eeprom_programmer",
+		description="Program the microcode for the 8 bit computer into EEPROMs "
+			"through the Arduino programmer. Without an action the commands "
+			"are read from the keyboard.",
+		epilog="actions: fill [--rom 0,1,2] [--diff] [--clear] [--verify], "
+			"verify [--rom 0,1,2], clear, read AAAA LLLL, dump FILE [AAAA LLLL], "
+			"chip N [--variants FILE,...], "
+			"show II [LL], check, "
+			"export [DIR], run SCRIPT..., parallel PORT[=0,1,2]... "
+			"[--diff] [--verify], shell")
+	parser.add_argument("action", nargs="?", default="shell",
+		choices=("shell", "fill", "verify", "clear", "read", "dump", "chip", "show",
+			"check", "export", "run", "parallel"))
+	parser.add_argument("operands", nargs="*",
+		help="hexadecimal operands for read and show, file and range for dump, "
+			"microcode sources for check, "
+			"byte of the control word for chip, directory for export, "
+			"files with one command per line for run, ports with the "
+			"sections to write for parallel")
+	parser.add_argument("--microcode", default=microcodeFile,
+		help="microcode source to program (default microcode.txt)")
+	parser.add_argument("--variants",
+		help="comma separated microcode sources for sections 0 - 3 of a chip "
+			"written with the chip action (default the --microcode source)")
+	parser.add_argument("--word-bits", type=int, default=24,
+		help="width of a control word, one EEPROM per 8 bits (default 24)")
+	parser.add_argument("--steps", type=int, default=8,
+		help="microcode steps per instruction the EEPROMs are wired for (default 8)")
+	parser.add_argument("--section-bits", type=int, default=2,
+		help="address bits selecting a section of an EEPROM (default 2)")
+	parser.add_argument("--byte-order", choices=("little", "big"), default="little",
+		help="little: CU00 holds the lowest byte of the control word (default), "
+			"big: the highest")
+	parser.add_argument("--port", default=portName,
+		help="serial port of the Arduino programmer")
+	parser.add_argument("--baud", type=int, default=portBaud,
+		help="speed the Arduino starts at (default 57600)")
+	parser.add_argument("--rates", default=",".join([str(rate) for rate in linkRates]),
+		help="comma separated faster speeds to try after the start, the fastest "
+			"that passes an echo test is used (default %(default)s)")
+	parser.add_argument("--no-negotiate", action="store_true",
+		help="stay at the speed the Arduino starts at")
+	parser.add_argument("--rom",
+		help="comma separated CU sections to program or verify (default all)")
+	parser.add_argument("--diff", action="store_true",
+		help="only write the blocks that changed since the last write")
+	parser.add_argument("--clear", action="store_true",
+		help="clear the whole EEPROM first and skip the erased blocks")
+	parser.add_argument("--no-backup", action="store_true",
+		help="do not dump a chip without snapshots to backups/ before writing it")
+	parser.add_argument("--no-check", action="store_true",
+		help="program microcode even when it has hazards, only warn about them")
+	parser.add_argument("--no-fill", action="store_true",
+		help="do not write runs of identical blocks with FP, for older firmware")
+	parser.add_argument("--verify", action="store_true",
+		help="verify the sections after programming them")
+	parser.add_argument("--mode", choices=("WR", "WB"), default=writeMode,
+		help="write blocks as WR text or WB binary frames (default WB)")
+	parser.add_argument("--timeout", type=float, default=3.0,
+		help="seconds without response before a command stalls")
+	parser.add_argument("--retries", type=int, default=3,
+		help="times a stalled command is sent again")
+	parser.add_argument("--inflight", type=int, default=2,
+		help="commands in the window, as far as the Arduino buffer allows")
+	parser.add_argument("--trace",
+		help="file to log every serial write and read to, with its timing")
+	parser.add_argument("--reopen", type=float, default=reconnectTimeout,
+		help="seconds a write that lost the link tries to reconnect and resume, "
+			"0 to give up at once (default %(default).0f)")
+	parser.add_argument("--reverify", action="store_true",
+		help="read back the block in flight when the link failed before resuming")
+	parser.add_argument("--quiet", action="store_true",
+		help="do not show the responses of the Arduino")
+	parser.add_argument("--echo-rate", type=int, default=0,
+		help="most response lines shown per second, the rest are counted (default all)")
+	args = parser.parse_args(argv)
+	if args.action == "read" and len(args.operands) != 2:
+		parser.error("read takes an address and a length")
+	if args.action == "chip" and (len(args.operands) != 1 or not args.operands[0].isdigit()):
+		parser.error("chip takes the byte of the control word its EEPROM holds")
+	if args.action == "dump" and len(args.operands) not in (1, 3):
+		parser.error("dump takes a file, optionally followed by an address and a length")
+	if args.action in ("show", "run", "parallel") and not args.operands:
+		parser.error(args.action + " takes at least one operand")
+	return args
 
-exit()
+
+#
+# === Run the program, the exit code is 0 on success and 1 on failure
+#
+def main(argv=None):
+	global writeMode, fillRuns, autoBackup, reconnectTimeout, verifyResume, variantFiles
+	global microcodeFile, layout, checkHazards, portName, portBaud, portRates
+	args = parseArguments(argv)
+	reconnectTimeout = max(args.reopen, 0.0)
+	if args.variants:
+		variantFiles = args.variants.split(",")
+	verifyResume = args.reverify
+	writeMode = args.mode
+	fillRuns = not args.no_fill
+	autoBackup = not args.no_backup
+	checkHazards = not args.no_check
+	microcodeFile = args.microcode
+	print "# === Program gaw_eeprom_programmer starts"
+	try:
+		layout = gaw_layout.Layout(args.word_bits, args.steps, 8, args.section_bits,
+			args.byte_order)
+		loadMicrocode()
+		rates = []
+		if not args.no_negotiate:
+			rates = [int(rate) for rate in args.rates.split(",")]
+		if args.action == "show":
+			showInstructions(int(args.operands[0], 16),
+				int((args.operands + ["1"])[1], 16))
+			return 0
+		if args.action == "export":
+			exportImages((args.operands + ["export"])[0])
+			return 0
+		if args.action == "check":
+			return not checkMicrocode(args.operands or variantFiles or None) and 1 or 0
+		if args.action == "fill":
+			preflight()						# before the port is opened
+		if args.action == "chip":
+			preflight(variantSources())
+		if args.action == "parallel":
+			ok = parallelFill(portAssignments(args.operands), args.baud, args.diff,
+				args.verify, {"timeout": args.timeout, "retries": args.retries,
+					"inFlight": max(args.inflight, 1)}, rates)
+		else:
+			commands = actionCommands(args)
+			portName, portBaud, portRates = args.port, args.baud, rates
+			linkOptions.update({"timeout": args.timeout, "retries": args.retries,
+				"inFlight": max(args.inflight, 1), "echo": not args.quiet,
+				"echoRate": max(args.echo_rate, 0)})
+			try:
+				if args.trace:
+					setTrace(args.trace)
+				if args.action == "shell":
+					ok = interactive()
+				elif args.action == "run":
+					ok = all(runScript(path) for path in args.operands)
+				else:
+					ok = all(executeCommand(command) for command in commands)
+			finally:
+				closeLink()
+	except (ProgrammerError, gaw_microcode.MicrocodeError, gaw_layout.LayoutError,
+			serial.SerialException, EnvironmentError, ValueError) as e:
+		print "ERROR -", e
+		return 1
+	print "# === End program"
+	if not ok:
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
 
 # Helpfull information used for programming...
 #
@@ -618,3 +2568,18 @@ exit()
 # .....+....1....+....2....+....3. position
 # ....+....1....+....2....+....3.. length
 #
+# RB 0000 0800
+#    answered by "RB aaaa llll", llll raw bytes and a CRC-16/CCITT
+#
+# FP 0000 0800 00 00 01 00 00 00 00 00
+#    fills 0800 bytes from 0000 with the 8 values, answered by "FP aaaa llll"
+#
+# SP 1000000
+#    switches the Arduino to 1000000 baud after answering "SP 1000000 <",
+#    SK at the new speed keeps it, without SK it falls back to 57600
+# EC text
+#    answered by "EC text <", to test the link
+#
+# WB <adr hi> <adr lo> <len> <len data bytes> <crc hi> <crc lo>
+#    binary frame, no spaces and no '!', CRC-16/CCITT over adr, len and data
+#
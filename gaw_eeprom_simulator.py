@@ -0,0 +1,562 @@
+#!/usr/bin/python
+
+# ------------------------------------------------------------------------
+# Program		:	gaw_eeprom_simulator.py
+#
+# Function		:	simulate the Arduino EEPROM programmer running
+#					EEPROM_CU_Programmer.ino on a pseudo terminal, so
+#					gaw_eeprom_programmer.py can be run and timed
+#					without the hardware
+#
+# ------------------------------------------------------------------------
+# 						GNU LICENSE CONDITIONS
+# ------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# ------------------------------------------------------------------------
+#				Copyright (C) 2017 Gerard Wassink
+# ------------------------------------------------------------------------
+
+import os
+import pty
+import sys
+import tty
+import time
+import random
+import select
+import argparse
+import binascii
+import threading
+
+
+#
+# === Raised inside the simulated firmware when the port is closed or
+#		opened again, which resets the Arduino
+#
+class Reset(Exception):
+	pass
+
+
+#
+# === Simulated Arduino Nano with the EEPROM programmer firmware
+#
+#	The firmware is modelled command for command, with its prompts, its
+#	80 character command buffer and its messages. Bytes from the host
+#	arrive at the speed of baud and land in a serial receive ring of
+#	rxBuffer bytes, bytes that do not fit are lost as on the Arduino.
+#	Output leaves at the speed of baud as well. The 8K EEPROM takes
+#	writeCycle seconds per byte written, or per page of 64 bytes when
+#	pageMode is set.
+#
+#	Opening the port resets the simulated Arduino, like the DTR line does
+#	on the real one. The EEPROM keeps its contents.
+#
+#	SP switches the speed of the simulated line, bytes are garbled above
+#	maxBaud as on a link that is not stable at that speed.
+#
+#	With dropAfter set the Arduino stops responding after that many
+#	commands, once, until the port is opened again, as when the USB
+#	cable comes loose.
+#
+class Simulator(object):
+
+	def __init__(self, baud=57600, writeCycle=0.005, pageMode=True, rxBuffer=64,
+			maxBaud=1000000, dropAfter=0):
+		self.baseBaud = baud
+		self.dropAfter = dropAfter
+		self.baud = baud
+		self.maxBaud = maxBaud
+		self.speedPending = False
+		self.speedTime = 0
+		self.writeCycle = writeCycle
+		self.pageMode = pageMode
+		self.rxBuffer = rxBuffer
+		self.memory = bytearray(8192)
+		self.ring = bytearray()
+		self.taking = None					# what the firmware reads right away
+		self.line = ""						# command read so far
+		self.frame = bytearray()			# binary frame read so far
+		self.lock = threading.Condition()
+		self.connected = False
+		self.generation = 0					# counts resets of the Arduino
+		self.current = 0
+		self.running = False
+		self.port = None
+		self.statistics = dict.fromkeys(("received", "sent", "dropped", "commands",
+			"writeCycles"), 0)
+
+
+	#
+	# === Open the pseudo terminal and start the Arduino, returns the name
+	#		of the port to open
+	#
+	def start(self):
+		self.master, slave = pty.openpty()
+		tty.setraw(slave)
+		self.port = os.ttyname(slave)
+		os.close(slave)						# only the host keeps it open
+		self.running = True
+		for target in (self.receiver, self.firmware):
+			t = threading.Thread(target=target)
+			t.daemon = True
+			t.start()
+		return self.port
+
+
+	#
+	# === Stop the simulation
+	#
+	def stop(self):
+		with self.lock:
+			self.running = False
+			self.lock.notify_all()
+		os.close(self.master)
+
+
+	#
+	# === Time taken on the serial line by a number of bytes, 10 bits each
+	#
+	def wire(self, count):
+		return 10.0 * count / self.baud
+
+
+	#
+	# === Bytes as they come across the line, garbled above maxBaud
+	#
+	def garble(self, data):
+		if self.baud <= self.maxBaud:
+			return data
+		return bytearray([c ^ 0x10 if random.random() < 0.3 else c for c in bytearray(data)])
+
+
+	#
+	# === Receive bytes from the host into the serial receive ring
+	#
+	#	A closed port reads as an error on the master side of the pseudo
+	#	terminal, an open port without data does not become readable.
+	#
+	def receiver(self):
+		while self.running:
+			try:
+				readable = select.select([self.master], [], [], 0.05)[0]
+				if not readable:
+					if not self.connected:
+						self.reset(True)
+					continue
+				data = self.garble(os.read(self.master, 256))
+			except (OSError, select.error, ValueError):
+				if self.connected:
+					self.reset(False)
+				time.sleep(0.05)
+				continue
+			if not self.connected:
+				self.reset(True)
+			for start in range(0, len(data), 16):	# arrive a few at a time
+				part = data[start:start + 16]
+				time.sleep(self.wire(len(part)))
+				with self.lock:
+					self.statistics["received"] += len(part)
+					room = max(self.rxBuffer - 1 - len(self.ring) + self.consumed(), 0)
+					self.ring += part[:room]
+					self.statistics["dropped"] += max(len(part) - room, 0)
+					self.lock.notify_all()
+
+
+	#
+	# === Bytes in the ring the firmware is reading as fast as they come
+	#
+	#	The Arduino empties its ring while it fills the command buffer, up
+	#	to the '!', or while it reads the rest of a binary frame. Python
+	#	threads do not switch that fast, so those bytes are not counted
+	#	against the room in the ring, from the moment the command before
+	#	completed. A line that turns out to start with WB and a frame
+	#	whose length byte has come in count up to the end of the frame,
+	#	whatever bytes it holds.
+	#
+	def consumed(self):
+		if self.taking == "line":
+			head = self.line + str(self.ring[:max(2 - len(self.line), 0)])
+			if head[:2] == "WB":
+				return min(2 - len(self.line), len(self.ring)) + self.frameRest(
+					bytearray(), 2 - len(self.line))
+			end = self.ring.find("!")
+			if end < 0:
+				return len(self.ring)
+			return end + 1
+		if self.taking == "frame":
+			return self.frameRest(self.frame, 0)
+		return 0
+
+
+	#
+	# === Bytes of the ring from offset on that belong to a binary frame of
+	#		which frame was read already, the rest of the ring as long as
+	#		its length byte has not come in
+	#
+	def frameRest(self, frame, offset):
+		available = max(len(self.ring) - offset, 0)
+		if len(frame) >= 3:
+			length = frame[2]
+		elif available > 2 - len(frame):
+			length = self.ring[offset + 2 - len(frame)]
+		else:
+			return available
+		return min(min(length, 64) + 5 - len(frame), available)
+
+
+	#
+	# === The port was opened or closed, either way the Arduino resets
+	#
+	def reset(self, connected):
+		with self.lock:
+			self.connected = connected
+			self.generation += 1
+			self.ring = bytearray()
+			self.baud = self.baseBaud
+			self.speedPending = False
+			self.lock.notify_all()
+
+
+	#
+	# === Run the firmware from every reset of the Arduino
+	#
+	def firmware(self):
+		while self.running:
+			with self.lock:
+				while self.running and not self.connected:
+					self.lock.wait(0.1)
+				self.current = self.generation
+			try:
+				self.session()
+			except Reset:
+				pass
+			except OSError:
+				time.sleep(0.05)
+
+
+	#
+	# === Read the next byte from the receive ring, None after timeout
+	#		seconds without one
+	#
+	def read(self, timeout=None):
+		deadline = None
+		if timeout is not None:
+			deadline = time.time() + timeout
+		with self.lock:
+			while not self.ring:
+				if not self.running or self.generation != self.current:
+					raise Reset()
+				if deadline is not None and time.time() >= deadline:
+					return None
+				self.lock.wait(0.05)
+			c = self.ring[0]
+			del self.ring[0]
+			return c
+
+
+	#
+	# === Send bytes to the host, taking their time on the serial line
+	#
+	def write(self, data):
+		if not self.running or self.generation != self.current:
+			raise Reset()
+		os.write(self.master, str(self.garble(data)))
+		self.statistics["sent"] += len(data)
+		time.sleep(self.wire(len(data)))
+
+
+	#
+	# === Send a line to the host; a line ending in '<' completes the
+	#		command, from then on the firmware takes the next one
+	#
+	def println(self, text):
+		if text.rstrip().endswith("<"):
+			with self.lock:
+				self.line = ""
+				self.taking = "line"
+		self.write(text + "\r\n")
+
+
+	#
+	# === EEPROM write cycles
+	#
+	def writeByte(self, address, value):
+		self.memory[address] = value
+		self.statistics["writeCycles"] += 1
+		time.sleep(self.writeCycle)
+
+
+	def writeBlock(self, address, data):
+		done = 0
+		while done < len(data):
+			count = min(64 - (address + done) % 64, len(data) - done)
+			if self.pageMode:
+				self.memory[address + done:address + done + count] = data[done:done + count]
+				self.statistics["writeCycles"] += 1
+				time.sleep(self.writeCycle)
+			else:
+				for i in range(done, done + count):
+					self.writeByte(address + i, data[i])
+			done += count
+
+
+	#
+	# === The firmware: prompt, fill the buffer, check and process
+	#
+	def session(self):
+		self.println("\tArduino starts")
+		self.println("\tArduino initialisation complete")
+		while True:
+			self.println(">")
+			buf = self.fill()
+			if buf is None:
+				continue
+			self.statistics["commands"] += 1
+			if self.statistics["commands"] == self.dropAfter:
+				while True:					# dead until the port is opened again
+					self.read()
+			if buf == "WB":
+				self.writeBinary(buf)
+			else:
+				self.check(buf)
+
+
+	#
+	# === Fill the command buffer up to the closing '!', returns None after
+	#		an error; "WB" is returned as soon as it is received, a binary
+	#		frame follows it
+	#
+	#	Without SK two seconds after a change of speed, the speed falls
+	#	back to the one the Arduino started at.
+	#
+	def fill(self):
+		buf = ""
+		self.line = ""
+		self.taking = "line"
+		try:
+			while True:
+				timeout = None
+				if self.speedPending:
+					timeout = max(self.speedTime + 2.0 - time.time(), 0)
+				c = self.read(timeout)
+				if c is None:				# Serial.end() drops what came in
+					with self.lock:
+						self.speedPending = False
+						self.baud = self.baseBaud
+						self.ring = bytearray()
+					return None
+				buf = buf + chr(c)
+				self.line = buf
+				if len(buf) > 79:
+					self.error(buf, "Received more than 80 characters, buffer purged")
+					return None
+				if buf == "WB":				# the frame follows at once
+					with self.lock:
+						self.frame = bytearray()
+						self.taking = "frame"
+					return buf
+				if buf[-1] == '!':
+					return buf[:-1]
+		finally:
+			self.line = ""
+			if self.taking == "line":
+				self.taking = None
+
+
+	def error(self, buf, text):
+		self.println("Received: " + buf)
+		self.println("ERROR - " + text + " <")
+
+
+	#
+	# === Check the command and process it
+	#
+	def check(self, command):
+		if len(command) < 2:
+			self.error(command, "Received less than two characters, buffer purged, try again")
+			return
+		cmd = command[:2]
+		if cmd in ("RD", "RB") and len(command) < 11:
+			self.error(command, "Insufficient operands for Read command")
+		elif cmd == "WR" and len(command) < 30:
+			self.error(command, "Insufficient operands for Write command")
+		elif cmd == "FP" and len(command) < 35:
+			self.error(command, "Insufficient operands for Fill command")
+		elif cmd == "SP" and len(command) < 4:
+			self.error(command, "Insufficient operands for Speed command")
+		elif cmd == "CL":
+			self.clear()
+		elif cmd == "RD":
+			self.printContents(x2i(command[3:7]), x2i(command[8:12]))
+			self.println("< ")
+		elif cmd == "RB":
+			self.sendContents(x2i(command[3:7]), x2i(command[8:12]))
+			self.println(" <")
+		elif cmd == "WR":
+			address = x2i(command[3:7])
+			values = [x2i(command[8 + 3 * i:10 + 3 * i]) for i in range(0, 8)]
+			self.write("%04x %s" % (address, " ".join(["%02x" % v for v in values])))
+			for i in range(0, 8):
+				self.writeByte((address + i) & 0x1FFF, values[i])
+			self.println(" <")
+		elif cmd == "FP":
+			address = x2i(command[3:7])
+			length = x2i(command[8:12])
+			pattern = [x2i(command[13 + 3 * i:15 + 3 * i]) for i in range(0, 8)]
+			self.write("FP %04x %04x" % (address, length))
+			self.writeBlock(address & 0x1FFF,
+				bytearray([pattern[i % 8] for i in range(0, length)]))
+			self.println(" <")
+		elif cmd == "SP":
+			speed = a2l(command[3:])
+			self.println("SP %d <" % speed)
+			self.baud = speed or self.baud
+			self.speedPending = True
+			self.speedTime = time.time()
+		elif cmd == "EC":
+			self.println(command + " <")
+		elif cmd == "SK":
+			self.speedPending = False
+			self.println("SK <")
+		elif cmd == "QT":
+			self.println("\tArduino ends <")
+			while True:						# the Arduino halts until reset
+				self.read()
+		else:
+			self.error(command, "Invalid command received")
+
+
+	#
+	# === Receive and process a binary Write frame
+	#
+	def writeBinary(self, buf):
+		frame = self.frame					# taken by fill(), before "WB" returned
+		self.taking = "frame"
+		try:
+			while len(frame) < 3 or len(frame) < frame[2] + 5:
+				c = self.read(timeout=1.0)
+				if c is None:
+					self.error(buf, "Incomplete Write Binary command")
+					return
+				frame.append(c)
+				if len(frame) == 3 and (frame[2] == 0 or frame[2] > 64):
+					self.error(buf, "Invalid length for Write Binary command")
+					return
+		finally:
+			self.taking = None
+		length = frame[2]
+		crc = (frame[length + 3] << 8) | frame[length + 4]
+		if binascii.crc_hqx(str(frame[:length + 3]), 0xFFFF) != crc:
+			self.error(buf, "Checksum error in Write Binary command")
+			return
+		address = (frame[0] << 8) | frame[1]
+		self.write("WB %04x %02x" % (address, length))
+		self.writeBlock(address, frame[3:length + 3])
+		self.println(" <")
+
+
+	#
+	# === CL, fill the EEPROM with zeroes page by page
+	#
+	def clear(self):
+		self.println("Erasing EEPROM")
+		for address in range(0, 8192, 64):
+			self.writeBlock(address, bytearray(64))
+			if address % 256 == 0:
+				self.println(". %04x" % address)
+		self.println(" done")
+		self.println("< ")
+
+
+	#
+	# === RD, print the contents 8 bytes per line
+	#
+	def printContents(self, start, length):
+		for base in range(start, start + length, 8):
+			if base % 256 == 0:
+				self.println(" ")
+			data = [self.memory[(base + i) & 0x1FFF] for i in range(0, 8)]
+			self.println("%04x %s" % (base, " ".join(["%02x" % v for v in data])))
+
+
+	#
+	# === RB, send the contents as raw bytes with a CRC
+	#
+	def sendContents(self, start, length):
+		self.println("RB %04x %04x" % (start, length))
+		data = bytearray([self.memory[a & 0x1FFF] for a in range(start, start + length)])
+		crc = binascii.crc_hqx(str(data), 0xFFFF)
+		self.write(str(data) + chr(crc >> 8) + chr(crc & 0xFF))
+
+
+#
+# === Hex to int as the firmware does it: up to the first non hex character
+#
+def x2i(s):
+	x = 0
+	for c in s:
+		if c not in "0123456789abcdefABCDEF":
+			break
+		x = x * 16 + int(c, 16)
+	return x
+
+
+#
+# === Decimal to int as atol does it: up to the first non digit
+#
+def a2l(s):
+	x = 0
+	for c in s:
+		if not c.isdigit():
+			break
+		x = x * 10 + int(c)
+	return x
+
+
+#
+# === Run the simulator until interrupted
+#
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="gaw_eeprom_simulator",
+		description="Simulate the Arduino EEPROM programmer on a pseudo terminal.")
+	parser.add_argument("--baud", type=int, default=57600,
+		help="speed of the simulated serial line (default 57600)")
+	parser.add_argument("--write-cycle", type=float, default=5.0,
+		help="milliseconds per EEPROM write cycle (default 5)")
+	parser.add_argument("--no-page", action="store_true",
+		help="simulate an EEPROM without page write mode")
+	parser.add_argument("--max-baud", type=int, default=1000000,
+		help="fastest speed the simulated line is stable at (default 1000000)")
+	parser.add_argument("--drop-after", type=int, default=0,
+		help="stop responding after this many commands until the port is reopened")
+	args = parser.parse_args(argv)
+	simulator = Simulator(args.baud, args.write_cycle / 1000.0, not args.no_page,
+		maxBaud=args.max_baud, dropAfter=args.drop_after)
+	print "# === Simulated programmer on port", simulator.start()
+	print "# === Run: gaw_eeprom_programmer.py --port", simulator.port
+	sys.stdout.flush()
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	simulator.stop()
+	for name, value in sorted(simulator.statistics.items()):
+		print "# === %-12s %d" % (name, value)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
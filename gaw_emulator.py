@@ -0,0 +1,354 @@
+#!/usr/bin/python
+
+# ------------------------------------------------------------------------
+# Program		:	gaw_emulator.py
+#
+# Function		:	run programs for the 8 bit computer on the host,
+#					one microcode step at a time as the control words of
+#					the compiled microcode dictate, to test a new
+#					microcode before it is burned
+#
+# ------------------------------------------------------------------------
+# 						GNU LICENSE CONDITIONS
+# ------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# ------------------------------------------------------------------------
+#				Copyright (C) 2017 Gerard Wassink
+# ------------------------------------------------------------------------
+
+import sys
+import time
+import argparse
+
+import gaw_microcode
+
+
+#
+# === Raised when a program cannot be assembled or its run goes wrong
+#
+class EmulatorError(Exception):
+	pass
+
+
+#
+# === Result of the 74181 ALU for its mode and function S3 - S0, in terms
+#		of the A and B registers, arithmetic without the carry in
+#
+logicFunctions = ["~a", "~(a | b)", "~a & b", "0", "~(a & b)", "~b", "a ^ b", "a & ~b",
+	"~a | b", "~(a ^ b)", "b", "a & b", "0xFF", "a | ~b", "a | b", "a"]
+arithmeticFunctions = ["a", "a | b", "a | ~b", "-1", "a + (a & ~b)", "(a | b) + (a & ~b)",
+	"a - b - 1", "(a & ~b) - 1", "a + (a & b)", "a + b", "(a | ~b) + (a & b)",
+	"(a & b) - 1", "a + a", "(a | b) + a", "(a | ~b) + a", "a - 1"]
+
+
+#
+# === Registers, in the order of the list holding them
+#
+registers = ["PC", "MAR", "IR", "A", "B", "OUT"]
+
+
+#
+# === The 8 bit computer, run by the control words of compiled microcode
+#
+#	Every step all drivers selected put their value on the bus, then on
+#	the clock every register selected takes it in, CE counts the PC up,
+#	PCI loads it instead. RSC makes the next step 0, HLT stops the clock
+#	before anything is taken in. The ALU is a 74181 on A and B, ALM its
+#	mode, AL3 - AL0 its function and ALCI adding one.
+#
+#	Runs of steps are compiled to Python functions, one for every opcode
+#	and step to start at, ending at the step that loads the IR, resets
+#	the step counter or halts. run() only looks up the next function in
+#	blocks by IR and step, so programs run at millions of steps a second.
+#
+class Emulator(object):
+
+	def __init__(self, microcode):
+		self.microcode = microcode
+		self.masks = dict((name, microcode.masks.get(name, 0)) for name in ["PCO", "MO",
+			"AO", "BO", "EO", "MAI", "MI", "IRI", "AI", "BI", "OI", "CE", "PCI", "HLT",
+			"RSC", "ALM", "AL0", "AL1", "AL2", "AL3", "ALCI"])
+		compiled = {}
+		self.blocks = [self.compileBlock(op, step, compiled)
+			for op in range(0, 256) for step in range(0, microcode.steps)]
+		self.reset()
+
+
+	#
+	# === Clear the registers and the memory
+	#
+	def reset(self):
+		self.regs = [0, 0, 0, 0, 0, 0, 0]		# registers, then steps taken
+		self.ram = bytearray(256)
+		self.out = []
+		self.step = 0
+
+
+	#
+	# === Load bytes into memory
+	#
+	def load(self, data, address=0):
+		self.ram[address:address + len(data)] = bytearray(data)
+
+
+	def register(self, name):
+		return self.regs[registers.index(name)]
+
+
+	#
+	# === Run until HLT or until limit steps were taken, returns True
+	#		when halted
+	#
+	def run(self, limit=1000000):
+		blocks = self.blocks
+		regs = self.regs
+		ram = self.ram
+		out = self.out
+		shift = self.microcode.steps.bit_length() - 1
+		step = self.step
+		while step >= 0 and regs[6] < limit:
+			step = blocks[(regs[2] << shift) | step](regs, ram, out)
+		self.step = step
+		return step < 0
+
+
+	#
+	# === Python source of the value a control word puts on the bus
+	#
+	def busValue(self, word, where):
+		m = self.masks
+		drivers = []
+		if word & m["PCO"]:
+			drivers.append(("PCO", "pc"))
+		if word & m["MO"]:
+			drivers.append(("MO", "ram[mar]"))
+		if word & m["AO"]:
+			drivers.append(("AO", "a"))
+		if word & m["BO"]:
+			drivers.append(("BO", "b"))
+		if word & m["EO"]:
+			function = sum(1 << i for i, name in enumerate(["AL0", "AL1", "AL2", "AL3"])
+				if word & m[name])
+			if word & m["ALM"]:
+				alu = logicFunctions[function]
+			else:
+				alu = arithmeticFunctions[function]
+				if word & m["ALCI"]:
+					alu = "(%s) + 1" % alu
+			drivers.append(("EO", "(%s) & 0xFF" % alu))
+		if len(drivers) > 1:
+			return "raise EmulatorError(%r)" % ("%s: %s drive the bus at once" %
+				(where, ", ".join(name for name, source in drivers)))
+		if not drivers:
+			return "bus = 0"
+		return "bus = " + drivers[0][1]
+
+
+	#
+	# === Compile the steps of an opcode from step onwards into a function
+	#		taking the registers, the memory and the output list and
+	#		returning the next step, -1 after HLT
+	#
+	#	compiled maps the source of functions made before to the function,
+	#	the many opcodes with the same row share theirs.
+	#
+	def compileBlock(self, op, step, compiled):
+		m = self.masks
+		steps = self.microcode.steps
+		words = self.microcode.row(op)
+		lines = ["def block(regs, ram, out):",
+			"	pc, mar, ir, a, b, o, n = regs"]
+		taken = 0
+		following = -1
+		for current in range(step, steps):
+			word = words[current]
+			if word & m["HLT"]:
+				following = -1
+				break
+			taken += 1
+			lines.append("	" + self.busValue(word, "0x%02X step %d" % (op, current)))
+			for signal, target in [("MI", "ram[mar]"), ("MAI", "mar"), ("IRI", "ir"),
+					("AI", "a"), ("BI", "b"), ("OI", "o")]:
+				if word & m[signal]:
+					lines.append("	%s = bus" % target)
+			if word & m["OI"]:
+				lines.append("	out.append(bus)")
+			if word & m["PCI"]:
+				lines.append("	pc = bus")
+			elif word & m["CE"]:
+				lines.append("	pc = (pc + 1) & 0xFF")
+			if word & m["RSC"]:
+				following = 0
+				break
+			following = (current + 1) % steps
+			if word & m["IRI"] or following == 0:
+				break
+		lines.append("	regs[:] = [pc, mar, ir, a, b, o, n + %d]" % taken)
+		lines.append("	return %d" % following)
+		source = "\n".join(lines) + "\n"
+		if source not in compiled:
+			namespace = {"EmulatorError": EmulatorError}
+			exec compile(source, "<0x%02X step %d>" % (op, step), "exec") in namespace
+			compiled[source] = namespace["block"]
+		return compiled[source]
+
+
+#
+# === Assemble a test program
+#
+#	Lines hold one instruction each, '#' starts a comment:
+#
+#		[LABEL:] NAME [OPERAND, ...]	opcode of the instruction named NAME
+#										in the microcode, then its operands
+#		[LABEL:] DB VALUE, ...			bytes
+#		EXPECT OUT VALUE, ...			values the program outputs
+#		EXPECT REG VALUE				A, B, PC, MAR or IR after HLT
+#		EXPECT MEM ADDRESS VALUE, ...	memory after HLT
+#
+#	Operands and values are numbers, 0x... for hexadecimal, or labels.
+#	Returns the bytes and the expectations as (what, address, values).
+#
+def assemble(text, microcode, path="<program>"):
+	opcodes = dict((microcode.names[op].split()[0].upper(), op) for op in microcode.listed)
+	labels = {}
+	lines = []
+	address = 0
+	for number, line in enumerate(text.splitlines(), 1):
+		line = line.partition("#")[0].strip()
+		if not line:
+			continue
+		if ":" in line:
+			label, sep, line = line.partition(":")
+			labels[label.strip().upper()] = address
+			line = line.strip()
+			if not line:
+				continue
+		name, sep, operands = line.partition(" ")
+		operands = [field.strip() for field in operands.replace(",", " ").split()]
+		name = name.upper()
+		if name != "EXPECT":
+			address += len(operands) + (name != "DB")
+		lines.append(("%s:%d: " % (path, number), name, operands))
+	data = bytearray()
+	expectations = []
+	for where, name, operands in lines:
+		if name == "EXPECT":
+			what = operands and operands[0].upper()
+			values = [value(operand, labels, where) for operand in operands[1:]]
+			if what == "OUT":
+				expectations.append((where, "OUTPUT", None, values))
+			elif what == "MEM" and len(values) > 1:
+				expectations.append((where, "MEM", values[0], values[1:]))
+			elif what in registers and len(values) == 1:
+				expectations.append((where, what, None, values))
+			else:
+				raise EmulatorError(where + "syntax: EXPECT OUT|REG|MEM ADDRESS VALUE...")
+			continue
+		values = [value(operand, labels, where) for operand in operands]
+		if name != "DB":
+			if name not in opcodes:
+				raise EmulatorError(where + "no instruction %s in the microcode" % name)
+			data.append(opcodes[name])
+		data.extend(values)
+	if len(data) > 256:
+		raise EmulatorError(path + ": program of %d bytes does not fit in 256" % len(data))
+	return (data, expectations)
+
+
+#
+# === Value of a number or a label, one byte
+#
+def value(text, labels, where):
+	if text.upper() in labels:
+		return labels[text.upper()]
+	try:
+		number = int(text, 0)
+	except ValueError:
+		raise EmulatorError(where + "unknown label '%s'" % text)
+	if number < 0 or number > 255:
+		raise EmulatorError(where + "%s does not fit in a byte" % text)
+	return number
+
+
+#
+# === Check the state after a run against the expectations, returns the
+#		ones that failed as text
+#
+def check(emulator, expectations):
+	failed = []
+	for where, what, address, values in expectations:
+		if what == "OUTPUT":
+			found = emulator.out
+		elif what == "MEM":
+			found = list(emulator.ram[address:address + len(values)])
+		else:
+			found = [emulator.register(what)]
+		if found != values:
+			failed.append("%sexpected %s %s, found %s" % (where, what,
+				" ".join("%02X" % v for v in values), " ".join("%02X" % v for v in found)))
+	return failed
+
+
+#
+# === Assemble and run test programs against a microcode source
+#
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="gaw_emulator",
+		description="Run test programs for the 8 bit computer against a microcode source.")
+	parser.add_argument("programs", nargs="+",
+		help="test programs, one instruction per line")
+	parser.add_argument("--microcode", default="microcode.txt",
+		help="microcode source to run them with (default microcode.txt)")
+	parser.add_argument("--limit", type=int, default=1000000,
+		help="steps a program may take before it counts as running away")
+	args = parser.parse_args(argv)
+	try:
+		microcode = gaw_microcode.load(args.microcode)
+		emulator = Emulator(microcode)
+	except (gaw_microcode.MicrocodeError, EnvironmentError) as e:
+		print "ERROR -", e
+		return 1
+	failures = 0
+	for path in args.programs:
+		try:
+			f = open(path)
+			try:
+				data, expectations = assemble(f.read(), microcode, path)
+			finally:
+				f.close()
+			emulator.reset()
+			emulator.load(data)
+			start = time.time()
+			halted = emulator.run(args.limit)
+			elapsed = max(time.time() - start, 1e-6)
+			if not halted:
+				raise EmulatorError("%s: no HLT within %d steps" % (path, args.limit))
+			failed = check(emulator, expectations)
+		except (EmulatorError, EnvironmentError) as e:
+			print "ERROR -", e
+			failures += 1
+			continue
+		steps = emulator.regs[6]
+		print "# === %s %s, %d steps in %.1f ms, %.1f M steps/s" % (path,
+			failed and "FAILED" or "ok", steps, 1000 * elapsed, steps / elapsed / 1e6)
+		for text in failed:
+			print "\t" + text
+		failures += bool(failed)
+	return failures and 1 or 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+# ------------------------------------------------------------------------
+# Program		:	gaw_hazards.py
+#
+# Function		:	check the compiled microcode of the 8 bit computer
+#					for mistakes that would only show on the board: bus
+#					conflicts, rows that never end, steps that never run
+#					and instructions that do not start with the fetch
+#
+# ------------------------------------------------------------------------
+# 						GNU LICENSE CONDITIONS
+# ------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# ------------------------------------------------------------------------
+#				Copyright (C) 2017 Gerard Wassink
+# ------------------------------------------------------------------------
+
+import sys
+import time
+import argparse
+
+import gaw_microcode
+
+
+#
+# === Signals that put a value on the bus, at most one per step
+#
+busDrivers = ["PCO", "MO", "AO", "BO", "EO"]
+
+
+#
+# === Check every row of compiled microcode
+#
+#	Returns the hazards found as (opcode, step, text), sorted by opcode
+#	and step; step is None for a hazard of the whole row. Checked are:
+#
+#		- more than one bus driver asserted in a step
+#		- a row without RSC or HLT, that runs its empty steps and
+#		  wraps around instead of ending
+#		- steps with signals after the RSC of the row, which never run
+#		- a row that does not start with the declared fetch steps
+#
+#	Each step costs a few and/or operations on masks made up front, and
+#	a row shared by many opcodes, as the default row is, is checked once,
+#	so the whole table takes about a millisecond.
+#
+def analyze(microcode):
+	masks = microcode.masks
+	drivers = [(name, masks[name]) for name in busDrivers if name in masks]
+	bus = 0
+	for name, mask in drivers:
+		bus |= mask
+	reset = masks.get("RSC", 0)
+	end = reset | masks.get("HLT", 0)
+	fetch = tuple(microcode.fetch)
+	steps = microcode.steps
+	rows = {}
+	for op in range(0, len(microcode.words) // steps):
+		rows.setdefault(tuple(microcode.row(op)), []).append(op)
+	hazards = []
+	for row, ops in rows.iteritems():
+		found = []
+		ended = False
+		for step, word in enumerate(row):
+			on = word & bus
+			if on & (on - 1):
+				found.append((step, "%s drive the bus at once" %
+					", ".join(name for name, mask in drivers if word & mask)))
+			if ended and word:
+				found.append((step, "%s after RSC, never runs" %
+					("|".join(microcode.signalNames(word)) or "0x%X" % word)))
+			if word & reset:
+				ended = True
+		if end and not [word for word in row if word & end]:
+			found.append((None, "no RSC or HLT, runs all %d steps" % steps))
+		if fetch and row[:len(fetch)] != fetch:
+			step = [i for i, word in enumerate(fetch) if row[i] != word][0]
+			found.append((step, "differs from the fetch"))
+		hazards.extend((op, step, text) for op in ops for step, text in found)
+	hazards.sort()
+	return hazards
+
+
+#
+# === The hazards per opcode
+#
+def byOpcode(hazards):
+	ops = {}
+	for op, step, text in hazards:
+		ops.setdefault(op, []).append(describe(step, text))
+	return ops
+
+
+#
+# === A hazard as shown in a report
+#
+def describe(step, text):
+	if step is None:
+		return text
+	return "step %d: %s" % (step, text)
+
+
+#
+# === Compact report, one line per hazard, the opcodes of a row with the
+#		same hazards as the one before folded into it
+#
+def report(microcode, hazards):
+	lines = []
+	ops = byOpcode(hazards)
+	last = None
+	folded = []
+	for op in sorted(ops):
+		if last is not None and ops[op] == ops[last]:
+			folded.append(op)
+			continue
+		if folded:
+			lines.append("\t      ... and %d more opcode(s) the same, up to 0x%02X" %
+				(len(folded), folded[-1]))
+			folded = []
+		last = op
+		for text in ops[op]:
+			lines.append("\t0x%02X  %-12s %s" % (op, microcode.names[op], text))
+	if folded:
+		lines.append("\t      ... and %d more opcode(s) the same, up to 0x%02X" %
+			(len(folded), folded[-1]))
+	return lines
+
+
+#
+# === Check a microcode source file and report what was found
+#
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="gaw_hazards",
+		description="Check the microcode of the 8 bit computer for hazards.")
+	parser.add_argument("sources", nargs="*", default=["microcode.txt"],
+		help="microcode source files (default microcode.txt)")
+	args = parser.parse_args(argv)
+	failures = 0
+	for path in args.sources:
+		try:
+			microcode = gaw_microcode.load(path)
+		except (gaw_microcode.MicrocodeError, EnvironmentError) as e:
+			print "ERROR -", e
+			failures += 1
+			continue
+		start = time.time()
+		hazards = analyze(microcode)
+		elapsed = time.time() - start
+		print "# === %s: %d hazard(s) in %d opcode(s), checked in %.1f ms" % (path,
+			len(hazards), len(byOpcode(hazards)), 1000 * elapsed)
+		for line in report(microcode, hazards):
+			print line
+		failures += bool(hazards)
+	return failures and 1 or 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
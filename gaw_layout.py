@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+# ------------------------------------------------------------------------
+# Program		:	gaw_layout.py
+#
+# Function		:	lay out the control words of the microcode over the
+#					EEPROMs of the control unit: how wide a word is, how
+#					many steps an instruction has, how the address is
+#					built and which EEPROM holds which byte
+#
+# ------------------------------------------------------------------------
+# 						GNU LICENSE CONDITIONS
+# ------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# ------------------------------------------------------------------------
+#				Copyright (C) 2017 Gerard Wassink
+# ------------------------------------------------------------------------
+
+import sys
+import struct
+from array import array
+from itertools import izip
+
+
+#
+# === Raised for a layout the hardware cannot have, or microcode that
+#		does not fit it
+#
+class LayoutError(Exception):
+	pass
+
+
+#
+# === Layout of the control words over the EEPROMs
+#
+#	The EEPROM address is the section, then the opcode, then the step:
+#
+#		A = SC << (opcodeBits + stepBits) | IR << stepBits | MC
+#
+#	so a section holds one table of opcodes x steps bytes, and an EEPROM
+#	of chipSize bytes has 2 ^ sectionBits of them. Every EEPROM holds one
+#	byte of the wordBits wide control word; with byteOrder "little" CU00
+#	holds bits 7 - 0, with "big" the most significant byte.
+#
+#	All images are cut from one packed copy of the words with extended
+#	slices, so they cost the same few C level passes whatever the width,
+#	the steps or the size of the EEPROM.
+#
+class Layout(object):
+
+	def __init__(self, wordBits=24, steps=8, opcodeBits=8, sectionBits=2, byteOrder="little"):
+		if wordBits not in (8, 16, 24, 32):
+			raise LayoutError("control words are 8, 16, 24 or 32 bits wide")
+		if steps not in (1, 2, 4, 8, 16):
+			raise LayoutError("steps must be 1, 2, 4, 8 or 16")
+		if opcodeBits < 1 or opcodeBits > 8:
+			raise LayoutError("opcodes are 1 - 8 bits")
+		if byteOrder not in ("little", "big"):
+			raise LayoutError("byte order is little or big")
+		self.wordBits = wordBits
+		self.steps = steps
+		self.stepBits = steps.bit_length() - 1
+		self.opcodeBits = opcodeBits
+		self.sectionBits = sectionBits
+		self.byteOrder = byteOrder
+		self.chips = wordBits // 8
+		self.words = (1 << opcodeBits) * steps		# control words per table
+		self.sectionSize = self.words
+		self.chipSize = self.sectionSize << sectionBits
+		self.sections = 1 << sectionBits
+		if self.chips > self.sections:
+			raise LayoutError("%d EEPROMs do not fit in %d sections" % (self.chips,
+				self.sections))
+
+
+	def __repr__(self):
+		return "%d bit words, %d steps, %d opcode bits, %d sections of %d bytes, %s endian" % (
+			self.wordBits, self.steps, self.opcodeBits, self.sections, self.sectionSize,
+			self.byteOrder)
+
+
+	#
+	# === Address of a step of an opcode in a section
+	#
+	def address(self, section, op, step=0):
+		return (section << (self.opcodeBits + self.stepBits)) | (op << self.stepBits) | step
+
+
+	#
+	# === Check that compiled microcode fits the layout
+	#
+	def check(self, microcode, path):
+		if microcode.steps != self.steps:
+			raise LayoutError("%s: the EEPROMs are wired for %d steps" % (path, self.steps))
+		if len(microcode.words) < self.words:
+			raise LayoutError("%s: %d control words, the layout needs %d" % (path,
+				len(microcode.words), self.words))
+		wide = [name for name, bit, description in microcode.signals if bit >= self.wordBits]
+		if wide:
+			raise LayoutError("%s: %s beyond the %d bits of a control word" % (path,
+				", ".join(wide), self.wordBits))
+
+
+	#
+	# === The section image of every EEPROM, CU00 first
+	#
+	def images(self, words):
+		raw = packWords(words[:self.words])
+		lanes = range(0, self.chips)
+		if self.byteOrder == "big":
+			lanes.reverse()
+		return [bytearray(raw[lane::4]) for lane in lanes]
+
+
+	#
+	# === The whole image of EEPROM chip holding a table per section,
+	#		sections without one hold fill
+	#
+	def chipImage(self, tables, chip, fill=0x00):
+		image = bytearray().join(self.images(words)[chip] for words in tables)
+		return image + bytearray([fill]) * (self.chipSize - len(image))
+
+
+#
+# === Control words as 4 bytes each, least significant first
+#
+def packWords(words):
+	packed = array('I', words)
+	if packed.itemsize != 4:
+		return struct.pack("<%dL" % len(words), *words)
+	if sys.byteorder == "big":
+		packed.byteswap()
+	return packed.tostring()
+
+
+#
+# === Offsets of the blocks of size bytes in which two images differ
+#
+#	The images are compared as 64 bit numbers, 8 bytes at a time, so a
+#	block of 8 bytes, one instruction of 8 steps, costs one comparison.
+#
+def changedBlocks(image, old, size=8):
+	count = len(image) // 8
+	new = struct.unpack("<%dQ" % count, str(image[:count * 8]))
+	before = struct.unpack("<%dQ" % count, str(old[:count * 8]))
+	changed = [i << 3 for i, (a, b) in enumerate(izip(new, before)) if a != b]
+	if size == 8:
+		return changed
+	return sorted(set(offset - offset % size for offset in changed))
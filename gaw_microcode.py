@@ -0,0 +1,305 @@
+#!/usr/bin/python
+
+# ------------------------------------------------------------------------
+# Program		:	gaw_microcode.py
+#
+# Function		:	compile the microcode source of the 8 bit computer
+#					into its table of control words, caching the result
+#					by the hash of the source
+#
+# ------------------------------------------------------------------------
+# 						GNU LICENSE CONDITIONS
+# ------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# ------------------------------------------------------------------------
+#				Copyright (C) 2017 Gerard Wassink
+# ------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from array import array
+
+
+#
+# === Changes whenever the compiled form changes, so old cache entries
+#		are not used
+#
+compilerVersion = "1"
+
+
+#
+# === Directory holding the compiled microcode per hash of its source
+#
+cacheDir = "cache"
+
+
+#
+# === Raised on an error in the microcode source, with its file and line
+#
+class MicrocodeError(Exception):
+	pass
+
+
+#
+# === Compiled microcode
+#
+#	words holds the control word for every step of every opcode, steps
+#	per opcode, opcode op starting at op * steps. signals lists the
+#	control signals as (name, bit, description) in the order declared,
+#	masks gives the bit mask of each. names holds the name of every
+#	opcode, listed the opcodes the source gives explicitly.
+#
+class Microcode(object):
+
+	def __init__(self, steps, signals, fetch, names, listed, words, digest=None):
+		self.steps = steps
+		self.signals = signals
+		self.masks = dict((name, 1 << bit) for name, bit, description in signals)
+		self.fetch = fetch
+		self.names = names
+		self.listed = listed
+		self.words = words
+		self.digest = digest
+		self.cached = False
+
+
+	#
+	# === The control words of one opcode
+	#
+	def row(self, op):
+		return self.words[op * self.steps:(op + 1) * self.steps]
+
+
+	#
+	# === Signal names asserted in a control word, from the highest bit
+	#
+	def signalNames(self, word):
+		return [name for name, bit, description in
+			sorted(self.signals, key=lambda s: -s[1]) if word & (1 << bit)]
+
+
+	def toDict(self):
+		return {"version": compilerVersion, "digest": self.digest, "steps": self.steps,
+			"signals": self.signals, "fetch": self.fetch, "names": self.names,
+			"listed": self.listed, "words": self.words.tolist()}
+
+
+	@classmethod
+	def fromDict(cls, d):
+		return cls(d["steps"], [tuple(s) for s in d["signals"]], d["fetch"],
+			d["names"], d["listed"], array('L', d["words"]), d["digest"])
+
+
+#
+# === Compile microcode source text
+#
+#	Lines hold one statement each, '#' starts a comment:
+#
+#		steps N				micro code steps per instruction
+#		signal NAME BIT		control signal on bit BIT of the control word
+#		fetch STEPS			steps every instruction starts with
+#		default NAME: STEPS	steps after the fetch for opcodes not listed
+#		OP NAME: STEPS		steps after the fetch for instruction OP
+#		OP NAME= STEPS		all steps of instruction OP, without the fetch
+#
+#	STEPS are separated by commas, each one signal names joined by '|'
+#	or a number; steps left out are 0.
+#
+def compileSource(text, path="<source>"):
+	steps = 8
+	signals = []
+	masks = {}
+	fetch = []
+	default = ("NOP", [0])
+	rows = {}
+	names = {}
+	for number, line in enumerate(text.splitlines(), 1):
+		where = "%s:%d: " % (path, number)
+		line, sep, comment = line.partition("#")
+		line = line.strip()
+		if not line:
+			continue
+		fields = line.split()
+		keyword = fields[0]
+		if keyword == "steps":
+			if len(fields) != 2 or not fields[1].isdigit() or int(fields[1]) not in (1, 2, 4, 8, 16):
+				raise MicrocodeError(where + "steps must be 1, 2, 4, 8 or 16")
+			steps = int(fields[1])
+		elif keyword == "signal":
+			if len(fields) != 3 or not fields[2].isdigit() or int(fields[2]) > 31:
+				raise MicrocodeError(where + "syntax: signal NAME BIT, BIT 0 - 31")
+			if fields[1] in masks:
+				raise MicrocodeError(where + "signal %s declared twice" % fields[1])
+			if int(fields[2]) in [bit for name, bit, description in signals]:
+				raise MicrocodeError(where + "bit %s already in use" % fields[2])
+			signals.append((fields[1], int(fields[2]), comment.strip()))
+			masks[fields[1]] = 1 << int(fields[2])
+		elif keyword == "fetch":
+			fetch = parseSteps(line[len(keyword):], masks, where)
+		elif keyword == "default":
+			name, sep, body = splitRow(line[len(keyword):], where)
+			default = (name, parseSteps(body, masks, where))
+		else:
+			try:
+				op = int(keyword, 0)
+			except ValueError:
+				raise MicrocodeError(where + "unknown statement '%s'" % keyword)
+			if op < 0 or op > 255:
+				raise MicrocodeError(where + "opcode 0x%X out of range" % op)
+			if op in rows:
+				raise MicrocodeError(where + "opcode 0x%02X given twice" % op)
+			name, sep, body = splitRow(line[len(keyword):], where)
+			words = parseSteps(body, masks, where)
+			if sep == ":":
+				words = fetch + words
+			if len(words) > steps:
+				raise MicrocodeError(where + "0x%02X %s has %d steps, at most %d fit" %
+					(op, name, len(words), steps))
+			rows[op] = words
+			names[op] = name
+	if len(fetch) + len(default[1]) > steps:
+		raise MicrocodeError(path + ": the default row has more than %d steps" % steps)
+	words = array('L', [0]) * (256 * steps)
+	for op in range(0, 256):
+		row = rows.get(op, fetch + default[1])
+		words[op * steps:op * steps + len(row)] = array('L', row)
+	return Microcode(steps, signals, fetch,
+		[names.get(op, default[0]) for op in range(0, 256)], sorted(rows), words)
+
+
+#
+# === Split "NAME: STEPS" or "NAME= STEPS" into name, separator and steps
+#
+def splitRow(text, where):
+	for i, c in enumerate(text):
+		if c in ":=":
+			name = " ".join(text[:i].split())
+			if not name:
+				raise MicrocodeError(where + "name missing before '%s'" % c)
+			return (name, c, text[i + 1:])
+	raise MicrocodeError(where + "':' or '=' missing after the name")
+
+
+#
+# === Control words of a comma separated list of steps
+#
+def parseSteps(text, masks, where):
+	words = []
+	for step in text.split(","):
+		word = 0
+		for term in step.split("|"):
+			term = term.strip()
+			if term in masks:
+				word |= masks[term]
+				continue
+			try:
+				word |= int(term, 0)
+			except ValueError:
+				raise MicrocodeError(where + "unknown signal '%s'" % term)
+		words.append(word)
+	return words
+
+
+#
+# === Name of the cache file for a hash of the source
+#
+def cacheFile(digest, directory=None):
+	return os.path.join(directory or cacheDir, digest + ".json")
+
+
+#
+# === Load the microcode from a source file, from the cache when it was
+#		compiled before
+#
+#	The cache is keyed by the hash of the compiler version and the
+#	source, so an unchanged source is never compiled again and a changed
+#	one always is.
+#
+def load(path, force=False, directory=None):
+	f = open(path)
+	try:
+		text = f.read()
+	finally:
+		f.close()
+	digest = hashlib.sha1(compilerVersion + "\n" + text).hexdigest()
+	if not force:
+		try:
+			f = open(cacheFile(digest, directory))
+			try:
+				microcode = Microcode.fromDict(json.load(f))
+			finally:
+				f.close()
+			microcode.cached = True
+			return microcode
+		except (IOError, ValueError, KeyError, TypeError):
+			pass							# not cached, or damaged
+	microcode = compileSource(text, path)
+	microcode.digest = digest
+	saveCache(microcode, directory)
+	return microcode
+
+
+#
+# === Save compiled microcode in the cache
+#
+def saveCache(microcode, directory=None):
+	directory = directory or cacheDir
+	try:
+		os.makedirs(directory)
+	except OSError:
+		if not os.path.isdir(directory):
+			raise
+	f = open(cacheFile(microcode.digest, directory), "w")
+	try:
+		json.dump(microcode.toDict(), f)
+	finally:
+		f.close()
+
+
+#
+# === Compile a source file and show what it holds
+#
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="gaw_microcode",
+		description="Compile the microcode source of the 8 bit computer.")
+	parser.add_argument("source", nargs="?", default="microcode.txt",
+		help="microcode source file (default microcode.txt)")
+	parser.add_argument("--force", action="store_true",
+		help="compile even when the source is in the cache")
+	args = parser.parse_args(argv)
+	start = time.time()
+	try:
+		microcode = load(args.source, args.force)
+	except (MicrocodeError, EnvironmentError) as e:
+		print "ERROR -", e
+		return 1
+	print "# === %s %s in %.1f ms" % (args.source,
+		microcode.cached and "loaded from the cache" or "compiled",
+		1000 * (time.time() - start))
+	print "# === %d signals, %d steps, %d instructions listed, hash %s" % (
+		len(microcode.signals), microcode.steps, len(microcode.listed),
+		microcode.digest[:12])
+	for op in microcode.listed:
+		print "\t0x%02X  %s" % (op, microcode.names[op])
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
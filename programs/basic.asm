@@ -0,0 +1,28 @@
+#
+# === Loads, stores, immediate arithmetic and logic, jumps and output
+#
+		LDAi 5
+		ADDi 3
+		OUTA				# 8
+		STAm result
+		LDBm result
+		XORi 0x0F			# A = 8 ^ 0x0F
+		OUTA				# 7
+		JMPi skip
+		DB 0xFF				# HLT when the jump fails
+skip:	ADDi 0xFE			# A = 7 - 2
+		OUTA
+		ANDi 0x0C
+		ORi 0x30
+		OUTA
+		NOTB
+		STBm copy			# ~0x30
+		OUTm copy
+		HLT
+result:	DB 0
+copy:	DB 0
+
+EXPECT OUT 8, 7, 5, 0x34, 0xCF
+EXPECT A 0x34
+EXPECT B 0xCF
+EXPECT MEM result 8, 0xCF